@@ -0,0 +1,164 @@
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import time
+
+from reactions import screen, sound, states, stats
+
+_READ_DURATION_SECONDS = 1
+_TIMED_READS = 1_000
+_LED_TOGGLES = 200
+_DISPLAY_WRITES = 50
+_AUDIO_STARTS = 10
+_CURSES_REFRESHES = 200
+
+logger = logging.getLogger(__name__)
+
+
+def run(buttons, display_devices, output_path, baseline_path, enable_curses):
+    # Measures each device path on this cabinet, and writes the results out as JSON so that
+    # hardware revisions and OS images can be compared.
+    results = {}
+    results.update(_bench_button_reads(buttons))
+    results.update(_bench_leds(buttons))
+    results.update(_bench_displays(display_devices))
+    results.update(_bench_audio(buttons))
+    if enable_curses:
+        results.update(screen.wrapper(lambda stdscr: _bench_curses(stdscr, buttons)))
+
+    report = {"host": _host(), "results": results}
+    output_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    logger.info("Wrote benchmark report to %s", output_path)
+
+    if baseline_path:
+        _compare(results, json.loads(baseline_path.read_text(encoding="utf-8"))["results"])
+    return report
+
+
+def _time(operation, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - start)
+    return stats.summarise(samples)
+
+
+def _bench_button_reads(buttons):
+    rpi_button = buttons.in_game_buttons[0].rpi_button
+
+    reads = 0
+    deadline = time.perf_counter() + _READ_DURATION_SECONDS
+    while time.perf_counter() < deadline:
+        for button in buttons.in_game_buttons:
+            _ = button.rpi_button.value
+        reads += len(buttons.in_game_buttons)
+
+    return {
+        "button_reads_per_second": {"reads_per_second": round(reads / _READ_DURATION_SECONDS)},
+        "button_read": _time(lambda: rpi_button.value, _TIMED_READS),
+    }
+
+
+def _bench_leds(buttons):
+    results = {}
+    for button in buttons.in_game_buttons:
+        # Switch on then off each time, so that every call actually changes the pin.
+        results[f"led_on_off_{button.key}"] = _time(
+            lambda led=button.led: (led.on(), led.off()), _LED_TOGGLES
+        )
+        button.led.off()
+    return results
+
+
+def _bench_displays(display_devices):
+    results = {}
+    for name, device in zip(("current", "high_score"), display_devices):
+        results[f"tm1637_numbers_{name}"] = _time(
+            lambda d=device: d.numbers(12, 34), _DISPLAY_WRITES
+        )
+        segments = device.encode_string("GOOD")
+        results[f"tm1637_write_{name}"] = _time(
+            lambda d=device, s=segments: d.write(s), _DISPLAY_WRITES
+        )
+        device.write([0, 0, 0, 0])
+    return results
+
+
+def _bench_audio(buttons):
+    samples = []
+    for _ in range(_AUDIO_STARTS):
+        start = time.perf_counter()
+        play_object = sound.try_play_audio(buttons.in_game_buttons[0].audio_segment)
+        samples.append(time.perf_counter() - start)
+        if play_object is not None:
+            play_object.stop()
+    return {"audio_start": stats.summarise(samples)}
+
+
+def _bench_curses(stdscr, buttons):
+    # The cost of a full Screen refresh, with a new score each time so that it always redraws.
+    results = {}
+    with screen.Screen(stdscr) as screen_:
+        state = states.WaitingOnButton(
+            high_score=datetime.timedelta(seconds=99),
+            round_=0,
+            button=buttons.in_game_buttons[0],
+            current_score=datetime.timedelta(),
+            round_start_score=datetime.timedelta(),
+        )
+
+        def refresh():
+            state.current_score += datetime.timedelta(milliseconds=10)
+            screen_.refresh(state, False, None)
+
+        results["curses_refresh"] = _time(refresh, _CURSES_REFRESHES)
+        state.current_score = datetime.timedelta()
+        results["curses_refresh_with_main"] = _time(
+            lambda: screen_.refresh(state, True, None), _CURSES_REFRESHES
+        )
+    return results
+
+
+def _host():
+    host = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+    }
+    for key, path, prefix in (
+        ("model", "/proc/device-tree/model", ""),
+        ("os", "/etc/os-release", "PRETTY_NAME="),
+    ):
+        try:
+            lines = pathlib.Path(path).read_text(encoding="utf-8").strip("\0\n").splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            if line.startswith(prefix):
+                host[key] = line[len(prefix) :].strip('"')
+                break
+    return host
+
+
+def _compare(results, baseline):
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ("median_us", "reads_per_second"):
+            if metric in result and baseline[name].get(metric):
+                logger.info(
+                    "%s %s: %s vs baseline %s (x%.2f)",
+                    name,
+                    metric,
+                    result[metric],
+                    baseline[name][metric],
+                    result[metric] / baseline[name][metric],
+                )
+
+
+def default_output_path():
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    return pathlib.Path(f"reactions-bench-{timestamp}.json")
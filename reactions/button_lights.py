@@ -9,6 +9,9 @@ FLICKER_PERIOD = datetime.timedelta(milliseconds=500)
 
 
 class ButtonLights(handler.Handler):
+    # Strategies are only chosen when the state type changes, FlickerStrategy uses wake_up_after.
+    subscriptions = {}
+
     def __init__(self, buttons):
         self.buttons = buttons
         self.strategy = None
@@ -39,12 +42,18 @@ class ButtonLights(handler.Handler):
 
         self.strategy.refresh(time_elapsed)
 
+    def wake_up_after(self):
+        return self.strategy.wake_up_after()
+
 
 class Strategy(abc.ABC):
     @abc.abstractmethod
     def refresh(self, time_elapsed):
         raise NotImplementedError()
 
+    def wake_up_after(self):
+        return None
+
 
 class FlickerStrategy(Strategy):
     def __init__(self, buttons, period):
@@ -62,6 +71,9 @@ class FlickerStrategy(Strategy):
                 else:
                     button.led.off()
 
+    def wake_up_after(self):
+        return self.delay
+
 
 class SingleLightStrategy(Strategy):
     def __init__(self, buttons, led_on_button):
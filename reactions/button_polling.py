@@ -1,97 +1,285 @@
-import collections
 import contextlib
 import logging
 import threading
 import time
 from typing import Optional
 
-_RPI_KEY_PRESSES = []
-_RPI_KEY_PRESSES_LOCK = threading.RLock()
-_BUTTON_POLL_THREAD: Optional[threading.Thread] = None
-_BUTTON_POLL_THREAD_EXIT = threading.Event()
+# If the poll thread hasn't been round its loop for this many ticks then it's considered stalled.
+_STALL_TICKS = 25
+# Restarting is only worth it for the occasional glitch.  If the thread keeps dying then give up and
+# let systemd start everything from scratch.
+_MAX_RESTARTS_PER_MINUTE = 10
+
+_SUPERVISOR: Optional["_Supervisor"] = None
 
 logger = logging.getLogger(__name__)
 
 
+class _KeyPresses:
+    # The key presses waiting to be read, and the lock which guards them.  They're only ever
+    # replaced together, so a stalled thread which resumes can only touch the ones it started with.
+    __slots__ = ("lock", "keys", "first_pressed_at")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.keys = []
+        # When the first of the keys was pressed by time.monotonic, if the input knows.
+        self.first_pressed_at = None
+
+
+_KEY_PRESSES = _KeyPresses()
+
+
 def read_keys(keys):
-    with _acquire_rpi_key_presses():
-        for key in _RPI_KEY_PRESSES:
-            keys.append(key)
-        _RPI_KEY_PRESSES.clear()
+    # Returns when the first of the keys read was pressed, or None if that isn't known.
+    try:
+        with _acquire_key_presses() as key_presses:
+            for key in key_presses.keys:
+                keys.append(key)
+            key_presses.keys.clear()
+            first_pressed_at = key_presses.first_pressed_at
+            key_presses.first_pressed_at = None
+            return first_pressed_at
+    except ValueError:
+        # The poll thread is holding the lock, most likely because it's stalled.  Don't take the
+        # game down with it, the supervisor will sort it out and the keys will arrive on a later
+        # tick.
+        logger.warning("Unable to read keys this tick")
+        return None
+
+
+def add_key_press(key, pressed_at=None):
+    # For other input threads which want to feed the same queue as the GPIO buttons.  pressed_at is
+    # when the key was actually pressed by time.monotonic, for inputs which timestamp their events.
+    # The GPIO buttons don't pass it, as their polling delay is part of the calibrated correction.
+    with _acquire_key_presses() as key_presses:
+        if not key_presses.keys:
+            key_presses.first_pressed_at = pressed_at
+        key_presses.keys.append(key)
 
 
 @contextlib.contextmanager
 def polling_thread(buttons, tick_period_seconds, debounce_period_seconds):
     # pylint: disable=global-statement
-    global _BUTTON_POLL_THREAD
-
-    _BUTTON_POLL_THREAD = threading.Thread(
-        target=_polling_thread_target,
-        kwargs={
-            "buttons": buttons,
-            "tick_period_seconds": tick_period_seconds,
-            "debounce_period_seconds": debounce_period_seconds,
-        },
-    )
-    _BUTTON_POLL_THREAD.start()
+    global _SUPERVISOR
+
+    _SUPERVISOR = _Supervisor(buttons, tick_period_seconds, debounce_period_seconds)
+    _SUPERVISOR.start()
 
     try:
         yield
     finally:
-        _BUTTON_POLL_THREAD_EXIT.set()
-        _BUTTON_POLL_THREAD.join(timeout=tick_period_seconds * 5)
-        if _BUTTON_POLL_THREAD.is_alive():
-            logger.error("Button poll thread didn't shutdown")
+        _SUPERVISOR.stop()
+        _SUPERVISOR = None
+
+
+def supervise_polling_thread():
+    # Called on every tick of the main loop.
+    if _SUPERVISOR:
+        _SUPERVISOR.check()
+
+
+def metrics():
+    if _SUPERVISOR:
+        return _SUPERVISOR.metrics()
+    return None
 
 
 @contextlib.contextmanager
-def _acquire_rpi_key_presses():
-    did_acquire = _RPI_KEY_PRESSES_LOCK.acquire(blocking=True, timeout=0.01)
+def _acquire_key_presses(timeout=0.01):
+    # Hold on to the key presses whose lock was acquired, in case the supervisor replaces them in
+    # the meantime.
+    key_presses = _KEY_PRESSES
+    did_acquire = key_presses.lock.acquire(blocking=True, timeout=timeout)
     if not did_acquire:
         raise ValueError("Unable to acquire lock")
     try:
-        yield
+        yield key_presses
     finally:
-        _RPI_KEY_PRESSES_LOCK.release()
+        key_presses.lock.release()
+
+
+def _release_stalled_lock():
+    # pylint: disable=global-statement
+    global _KEY_PRESSES
+
+    try:
+        with _acquire_key_presses(timeout=0):
+            return
+    except ValueError:
+        pass
+
+    logger.error("Stalled poll thread is holding the key press lock, replacing it")
+    stalled = _KEY_PRESSES
+    _KEY_PRESSES = _KeyPresses()
+    # Carry over any presses which were waiting to be read.  The stalled thread isn't running, and
+    # if it does resume it has already been told to exit, so it won't add any more.
+    _KEY_PRESSES.keys.extend(stalled.keys)
+    _KEY_PRESSES.first_pressed_at = stalled.first_pressed_at
+
+
+class _ButtonState:
+    # Updated in place on every tick of the poll loop.
+    __slots__ = ("button", "value", "delay")
+
+    def __init__(self, button):
+        self.button = button
+        self.value = 0
+        self.delay = 0
 
 
-def _polling_thread_target(buttons, tick_period_seconds, debounce_period_seconds):
-    button_state = collections.namedtuple("button_state", ["value", "delay"])
+class _PollThread:
+    def __init__(self, buttons, is_restart, tick_period_seconds, debounce_period_seconds):
+        self.exit = threading.Event()
+        self.started_at = None
+        # Written by the poll thread on every tick, and read by the supervisor on the main thread.
+        self.heartbeat = None
+        self.thread = threading.Thread(
+            target=_polling_thread_target,
+            name="button-poll",
+            kwargs={
+                "poll_thread": self,
+                "buttons": buttons,
+                "is_restart": is_restart,
+                "tick_period_seconds": tick_period_seconds,
+                "debounce_period_seconds": debounce_period_seconds,
+            },
+        )
+
+
+class _SupervisorMetrics:
+    __slots__ = ("restarts", "deaths", "stalls", "last_recovery_seconds", "max_recovery_seconds")
+
+    def __init__(self):
+        self.restarts = 0
+        self.deaths = 0
+        self.stalls = 0
+        self.last_recovery_seconds = None
+        self.max_recovery_seconds = None
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class _Supervisor:
+    # Restarts the poll thread in place if it dies or stops making progress, which is much quicker
+    # than the whole process being restarted by systemd and reloading all the audio and hardware.
+    def __init__(self, buttons, tick_period_seconds, debounce_period_seconds):
+        self.buttons = buttons
+        self.tick_period_seconds = tick_period_seconds
+        self.debounce_period_seconds = debounce_period_seconds
+        self.poll_thread = None
+        self.restart_times = []
+        # When the thread which was replaced last showed signs of life, if a restart has happened
+        # and the new thread hasn't yet completed a tick.
+        self.failed_at = None
+        self.counts = _SupervisorMetrics()
+
+    def start(self, is_restart=False):
+        self.poll_thread = _PollThread(
+            self.buttons, is_restart, self.tick_period_seconds, self.debounce_period_seconds
+        )
+        self.poll_thread.started_at = self.poll_thread.heartbeat = time.monotonic()
+        self.poll_thread.thread.start()
+
+    def stop(self):
+        self.poll_thread.exit.set()
+        self.poll_thread.thread.join(timeout=self.tick_period_seconds * 5)
+        if self.poll_thread.thread.is_alive():
+            logger.error("Button poll thread didn't shutdown")
+
+    def check(self):
+        poll_thread = self.poll_thread
+        now = time.monotonic()
+
+        if self.failed_at is not None and poll_thread.heartbeat > poll_thread.started_at:
+            self._record_recovery(poll_thread.heartbeat - self.failed_at)
+
+        if not poll_thread.thread.is_alive():
+            self.counts.deaths += 1
+            logger.error("Button poll thread died, restarting")
+        elif now - poll_thread.heartbeat > self.tick_period_seconds * _STALL_TICKS:
+            self.counts.stalls += 1
+            logger.error(
+                "Button poll thread stalled for %.3fs, restarting", now - poll_thread.heartbeat
+            )
+        else:
+            return
+
+        self._restart(now)
+
+    def _restart(self, now):
+        self.restart_times = [at for at in self.restart_times if now - at < 60] + [now]
+        if len(self.restart_times) > _MAX_RESTARTS_PER_MINUTE:
+            raise ValueError("Button poll thread keeps dying")
+
+        if self.failed_at is None:
+            self.failed_at = self.poll_thread.heartbeat
+        self.counts.restarts += 1
+
+        # A stalled thread can't be killed, but it will exit whenever it does get going again.
+        self.poll_thread.exit.set()
+        _release_stalled_lock()
+
+        self.start(is_restart=True)
+
+    def _record_recovery(self, recovery_seconds):
+        self.failed_at = None
+        counts = self.counts
+        counts.last_recovery_seconds = recovery_seconds
+        if counts.max_recovery_seconds is None or recovery_seconds > counts.max_recovery_seconds:
+            counts.max_recovery_seconds = recovery_seconds
+        logger.info(
+            "Button poll thread recovered in %.3fs, metrics: %s", recovery_seconds, self.metrics()
+        )
+
+    def metrics(self):
+        return self.counts.as_dict()
+
+
+def _polling_thread_target(
+    poll_thread, buttons, is_restart, tick_period_seconds, debounce_period_seconds
+):
     logger.info("Button poll loop start")
     try:
-        states = {button.key: button_state(0, 0) for button in buttons}
-        last_tick = time.time()
-        while not _BUTTON_POLL_THREAD_EXIT.is_set():
-            now = time.time()
+        button_states = [_ButtonState(button) for button in buttons]
+        if is_restart:
+            # Rebuild the debounce state from what the buttons are doing right now.  A button which
+            # is held down through the restart shouldn't count as a new press, and any bouncing has
+            # to settle before the next change is believed.
+            for button_state in button_states:
+                button_state.value = button_state.button.rpi_button.value
+                button_state.delay = debounce_period_seconds
+
+        last_tick = time.monotonic()
+        while not poll_thread.exit.is_set():
+            now = time.monotonic()
+            poll_thread.heartbeat = now
             time_elapsed = now - last_tick
 
-            for button in buttons:
-                (state, delay) = states[button.key]
-                delay = max(0, delay - time_elapsed)
-                if button.rpi_button.value != state and delay == 0:
-                    logger.info("Button state change %s->%s", state, button.rpi_button.value)
-                    states[button.key] = button_state(
-                        button.rpi_button.value, debounce_period_seconds
-                    )
+            for button_state in button_states:
+                delay = max(0, button_state.delay - time_elapsed)
+                value = button_state.button.rpi_button.value
+                if value != button_state.value and delay == 0:
+                    logger.info("Button state change %s->%s", button_state.value, value)
+                    button_state.value = value
+                    button_state.delay = debounce_period_seconds
 
-                    match button.rpi_button.value:
+                    match value:
                         case 0:
                             pass
                         case 1:
-                            with _acquire_rpi_key_presses():
-                                _RPI_KEY_PRESSES.append(button.key)
+                            # A thread which resumes after being replaced mustn't report a
+                            # press the new thread will also see.
+                            if not poll_thread.exit.is_set():
+                                add_key_press(button_state.button.key)
                         case _:
                             raise NotImplementedError()
                 else:
-                    states[button.key] = button_state(state, delay)
+                    button_state.delay = delay
 
             last_tick = now
             time.sleep(tick_period_seconds)
     except:
         logger.exception("Button poll thread died")
         raise
-
-
-def check_polling_thread_alive():
-    if _BUTTON_POLL_THREAD and not _BUTTON_POLL_THREAD.is_alive():
-        raise ValueError("Button poll thread died")
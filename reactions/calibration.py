@@ -0,0 +1,108 @@
+import datetime
+import json
+import logging
+import pathlib
+import random
+import statistics
+import time
+
+import gpiozero
+
+from reactions import button_polling, stats
+
+# Spare pins used for calibration.  A photodiode (or a loopback wire from the lamp's transistor)
+# goes on _SENSOR_PIN and reads high while the lamp is lit, and _LOOPBACK_PIN is wired to the
+# button input so that driving it low looks exactly like the button being pressed.
+_SENSOR_PIN = 20
+_LOOPBACK_PIN = 21
+_TIMEOUT_SECONDS = 1
+_SETTLE_SECONDS = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+def save_file_location():
+    return pathlib.Path.home() / ".reactions-calibration"
+
+
+def read_correction():
+    # The fixed latency to take off every press, or zero if this cabinet has never been calibrated.
+    try:
+        calibration = json.loads(save_file_location().read_text(encoding="utf-8"))
+        return datetime.timedelta(microseconds=calibration["correction_us"])
+    except FileNotFoundError:
+        return datetime.timedelta()
+    except (ValueError, KeyError):
+        # If the file gets corrupted somehow then carry on anyway
+        logger.warning("Unable to read calibration", exc_info=True)
+        return datetime.timedelta()
+
+
+def calibrate(buttons, rounds, key, samples, main_loop_tick_period_seconds):
+    # rounds plays the ticks at the end and start of a round through the game's own state machine
+    # and handlers, with end_round() and start_round(button).
+    button = buttons.buttons_by_key[key]
+    with gpiozero.DigitalInputDevice(_SENSOR_PIN, pull_up=False) as sensor:
+        led_on = [_measure_led_on(rounds, button, sensor) for _ in range(samples)]
+    with gpiozero.DigitalOutputDevice(
+        _LOOPBACK_PIN, active_high=False, initial_value=False
+    ) as loopback:
+        input_detect = [
+            _measure_input_detect(button, loopback, main_loop_tick_period_seconds)
+            for _ in range(samples)
+        ]
+
+    calibration = {
+        "calibrated_at": datetime.datetime.now().isoformat(),
+        "key": key,
+        "led_on": stats.summarise(led_on),
+        "input_detect": stats.summarise(input_detect),
+        "correction_us": round((statistics.median(led_on) + statistics.median(input_detect)) * 1e6),
+    }
+    save_file_location().write_text(json.dumps(calibration, indent=2), encoding="utf-8")
+    logger.info("Saved calibration to %s: %s", save_file_location(), calibration)
+    return calibration
+
+
+def _measure_led_on(rounds, button, sensor):
+    # From the tick on which the game starts a new round to the lamp actually being lit.  This
+    # covers the state machine choosing the button and then every output handler refreshing in the
+    # same order as in the game, so the segment displays and screen are included.  The first round
+    # of each game also replaces GOOD LUCK on the segment displays with the score, which isn't
+    # covered, but every later round starts from a cool down as it is here.
+    rounds.end_round()
+    _wait_for(lambda: not sensor.value)
+    time.sleep(_SETTLE_SECONDS * random.random())
+
+    start = time.perf_counter()
+    rounds.start_round(button)
+    _wait_for(lambda: sensor.value)
+    return time.perf_counter() - start
+
+
+def _measure_input_detect(button, loopback, main_loop_tick_period_seconds):
+    # From the button going down to the key showing up in the main loop, which has to wait for the
+    # poll thread and then for the main loop's next tick, just as in the game.
+    keys = []
+    time.sleep(_SETTLE_SECONDS * (1 + random.random()))
+    button_polling.read_keys(keys)
+
+    start = time.perf_counter()
+    loopback.on()
+    try:
+        deadline = start + _TIMEOUT_SECONDS
+        while button.key not in keys:
+            if time.perf_counter() > deadline:
+                raise ValueError("Loopback press was never seen, is it wired up?")
+            time.sleep(main_loop_tick_period_seconds)
+            button_polling.read_keys(keys)
+        return time.perf_counter() - start
+    finally:
+        loopback.off()
+
+
+def _wait_for(predicate):
+    deadline = time.perf_counter() + _TIMEOUT_SECONDS
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise ValueError("Sensor never changed, is it wired up?")
@@ -0,0 +1,208 @@
+import datetime
+import logging
+import statistics
+import threading
+import time
+
+import gpiozero
+from gpiozero.pins.mock import MockFactory, MockPin
+
+from reactions import handler, states
+
+# Ballpark per-operation latencies for a Raspberry Pi 3B+ running gpiozero on RPi.GPIO, and the
+# raspberrypi-tm1637 bit banging driver.  These are busy-waited rather than slept, as the real
+# calls hold the GIL for their whole duration.
+PIN_READ_SECONDS = 0.000_030
+PIN_WRITE_SECONDS = 0.000_040
+TM1637_NUMBERS_SECONDS = 0.006
+TM1637_WRITE_SECONDS = 0.006
+
+# How long the scripted player holds each button down for.  Comfortably longer than the debounce
+# period, so that each press is seen exactly once.
+_PRESS_HOLD_SECONDS = 0.1
+_PLAYER_TICK_SECONDS = 0.000_5
+_NEW_GAME_DELAY_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def install():
+    # Must be called before any gpiozero devices are created.
+    gpiozero.Device.pin_factory = MockFactory(pin_class=SlowMockPin)
+    logger.info("Using emulated hardware")
+
+
+def _spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class SlowMockPin(MockPin):
+    # A mock pin which takes as long as a real one to read or write, and remembers its value and
+    # when it last changed so that the scripted player can see lamps switch on without going
+    # through a (slow) read itself.
+    def __init__(self, factory, number):
+        self.changed_at = time.perf_counter()
+        self.last_value = False
+        super().__init__(factory, number)
+
+    def _get_state(self):
+        _spin(PIN_READ_SECONDS)
+        return super()._get_state()
+
+    def _set_state(self, value):
+        _spin(PIN_WRITE_SECONDS)
+        super()._set_state(value)
+
+    def _change_state(self, value):
+        is_changed = super()._change_state(value)
+        if is_changed:
+            self.last_value = value
+            self.changed_at = time.perf_counter()
+        return is_changed
+
+
+class FakeTM1637:
+    # Just enough of tm1637.TM1637 for segment_display.Display.
+    def __init__(self, clk, dio):
+        self.clk = clk
+        self.dio = dio
+        self.shown = None
+
+    def numbers(self, num1, num2, colon=True):
+        _spin(TM1637_NUMBERS_SECONDS)
+        self.shown = (num1, num2, colon)
+
+    def write(self, segments, pos=0):
+        _spin(TM1637_WRITE_SECONDS)
+        self.shown = (list(segments), pos)
+
+    def encode_string(self, string):
+        return [ord(char) for char in string]
+
+
+# Plays the game through the emulated pins: it watches the target button's lamp, and presses it a
+# fixed reaction time after the lamp switched on.  The state is only used to decide which button is
+# the target, when to press the new game button, and to measure how long it takes each press to
+# show up in the score.
+#
+# The difference between each round's score and the true reaction time (lamp on to button down)
+# is the total latency the hardware and the game loop add to a player's score.
+class ScriptedPlayer(handler.Handler):
+    subscriptions = {}
+
+    def __init__(self, buttons, reaction_time, games):
+        self.player = _PlayerThread(buttons, reaction_time.total_seconds())
+        self.games_remaining = games
+        self.is_done = False
+        self.round_start_score = None
+        self.press_to_score = []
+        self.score_errors = []
+
+    def __enter__(self):
+        self.player.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.player.exit.set()
+        self.player.join()
+        self.log_report()
+
+    def refresh(self, state, is_state_change, time_elapsed):
+        now = time.perf_counter()
+        # Only ever assigned, so the player thread can read it without a lock.
+        self.player.target = state.button if isinstance(state, states.WaitingOnButton) else None
+        match state:
+            case states.NotStarted() | states.GameFinished():
+                if self.games_remaining <= 0:
+                    self.is_done = True
+                else:
+                    self.player.press_new_game.set()
+            case states.WaitingOnButton(current_score=current_score):
+                self.round_start_score = current_score
+            case states.CoolDown(current_score=current_score):
+                self._record_round(now, current_score)
+            case states.GameFinishedCoolDown(current_score=current_score):
+                self._record_round(now, current_score)
+                self.games_remaining -= 1
+
+    def is_finished(self):
+        return self.is_done
+
+    def _record_round(self, now, current_score):
+        last_press = self.player.last_press
+        if last_press is None or self.round_start_score is None:
+            return
+        self.player.last_press = None
+        lamp_on_at, pressed_at = last_press
+        round_score = (current_score - self.round_start_score).total_seconds()
+        self.press_to_score.append(now - pressed_at)
+        self.score_errors.append(round_score - (pressed_at - lamp_on_at))
+
+    def log_report(self):
+        for name, samples in (
+            ("Press to score", self.press_to_score),
+            ("Score error", self.score_errors),
+        ):
+            if len(samples) < 2:
+                continue
+            samples = sorted(samples)
+            logger.info(
+                "%s over %s presses: median=%.2fms, p90=%.2fms, max=%.2fms",
+                name,
+                len(samples),
+                statistics.median(samples) * 1_000,
+                statistics.quantiles(samples, n=10)[-1] * 1_000,
+                samples[-1] * 1_000,
+            )
+
+
+class _PlayerThread(threading.Thread):
+    def __init__(self, buttons, reaction_seconds):
+        super().__init__(name="scripted-player")
+        self.buttons = buttons
+        self.reaction_seconds = reaction_seconds
+        self.press_new_game = threading.Event()
+        self.exit = threading.Event()
+        # The button to press, written by the main thread as the state changes.
+        self.target = None
+        # (lamp on, button down) for the last press, written here and taken by the main thread
+        # once the press has been scored.  Assigned as a whole so it's never seen half written.
+        self.last_press = None
+
+    def run(self):
+        pressed_lamp_on_at = None
+        while not self.exit.wait(_PLAYER_TICK_SECONDS):
+            if self.press_new_game.is_set():
+                self.press_new_game.clear()
+                time.sleep(_NEW_GAME_DELAY_SECONDS)
+                self._press(self.buttons.buttons_by_key["N"])
+                continue
+
+            # Only press in WaitingOnButton, so that lamps lit for any other reason (e.g. one at a
+            # time by LightsOnStrategy once the game is over) are never mistaken for a target.
+            target = self.target
+            if target is None:
+                continue
+            pin = target.led.pin
+            if not pin.last_value or pin.changed_at == pressed_lamp_on_at:
+                continue
+
+            lamp_on_at = pin.changed_at
+            # Sleep rather than spin, so that the player doesn't compete with the game for the GIL.
+            time.sleep(max(0.0, lamp_on_at + self.reaction_seconds - time.perf_counter()))
+            self.last_press = (lamp_on_at, time.perf_counter())
+            self._press(target)
+            pressed_lamp_on_at = lamp_on_at
+
+    @staticmethod
+    def _press(button):
+        pin = button.rpi_button.pin
+        pin.drive_low()
+        time.sleep(_PRESS_HOLD_SECONDS)
+        pin.drive_high()
+
+
+def scripted_player(buttons, reaction_ms, games):
+    return ScriptedPlayer(buttons, datetime.timedelta(milliseconds=reaction_ms), games)
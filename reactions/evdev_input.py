@@ -0,0 +1,211 @@
+import contextlib
+import fcntl
+import glob
+import logging
+import os
+import pathlib
+import select
+import struct
+import threading
+import time
+from typing import Optional
+
+from reactions import button_polling
+
+# struct input_event from linux/input.h: a timeval, then type, code and value.  Native sizes and
+# alignment, so this is right on both 32 and 64 bit Raspberry Pi OS.
+_EVENT = struct.Struct("llHHi")
+_EV_KEY = 0x01
+_KEY_DOWN = 1
+# _IOW('E', 0x90, int) and _IOW('E', 0xa0, int) from linux/input.h
+_EVIOCGRAB = 0x40044590
+_EVIOCSCLOCKID = 0x400445A0
+_CLOCK_MONOTONIC = 1
+_READ_EVENTS = 64
+_POLL_TIMEOUT_SECONDS = 0.05
+
+# Linux key codes for the keyboard keys the game already uses.  Encoders usually report joystick
+# buttons instead (BTN_TRIGGER is 288, BTN_THUMB 289...), which depend on how the cabinet is
+# wired, so those are configured with --evdev-keymap.
+DEFAULT_KEYMAP = {16: "Q", 17: "W", 18: "E", 30: "A", 31: "S", 32: "D", 49: "N"}
+
+_EVDEV_THREAD: Optional[threading.Thread] = None
+_EVDEV_THREAD_EXIT = threading.Event()
+
+logger = logging.getLogger(__name__)
+
+
+def parse_keymap(spec):
+    # e.g. "288=Q,289=W,290=E"
+    keymap = {}
+    for entry in spec.split(","):
+        code, key = entry.split("=")
+        keymap[int(code)] = key.strip().upper()
+    return keymap
+
+
+def device_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+@contextlib.contextmanager
+def reading_thread(paths, keymap):
+    # pylint: disable=global-statement
+    global _EVDEV_THREAD
+
+    # Regular files can't be polled, so recordings are read up front and replayed instead.
+    recordings = [path for path in paths if pathlib.Path(path).is_file()]
+    devices = dict(_open_device(path) for path in paths if path not in recordings)
+    replay = _Replay(recordings, keymap)
+    _EVDEV_THREAD = threading.Thread(
+        target=_reading_thread_target,
+        kwargs={"devices": devices, "keymap": keymap, "replay": replay},
+    )
+    _EVDEV_THREAD.start()
+
+    try:
+        yield
+    finally:
+        _EVDEV_THREAD_EXIT.set()
+        _EVDEV_THREAD.join(timeout=_POLL_TIMEOUT_SECONDS * 5)
+        if _EVDEV_THREAD.is_alive():
+            logger.error("evdev thread didn't shutdown")
+        # Any device which was unplugged has already been closed and removed.
+        for device_fd in list(devices):
+            os.close(device_fd)
+
+
+def check_reading_thread_alive():
+    if _EVDEV_THREAD and not _EVDEV_THREAD.is_alive():
+        raise ValueError("evdev thread died")
+
+
+def _open_device(path):
+    # Returns the file descriptor, and whether its timestamps are comparable with time.monotonic.
+    device_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        # Stop the encoder also typing into the console (or into curses, which would then see
+        # every key twice).
+        fcntl.ioctl(device_fd, _EVIOCGRAB, 1)
+        # Kernel timestamps default to the wall clock, ask for the same clock as time.monotonic.
+        fcntl.ioctl(device_fd, _EVIOCSCLOCKID, struct.pack("i", _CLOCK_MONOTONIC))
+    except OSError:
+        # Not an input device, e.g. a pipe replaying recorded events.  Timestamps are then only
+        # meaningful relative to each other.
+        logger.warning("Unable to grab %s, is it an input device?", path)
+        return device_fd, False
+    logger.info("Reading input events from %s", path)
+    return device_fd, True
+
+
+def _reading_thread_target(devices, keymap, replay):
+    logger.info("evdev loop start")
+    buffers = {device_fd: b"" for device_fd in devices}
+    max_latency = 0.0
+    replay.started_at = time.monotonic()
+    try:
+        with select.epoll() as epoll:
+            for device_fd in devices:
+                epoll.register(device_fd, select.EPOLLIN)
+
+            while not _EVDEV_THREAD_EXIT.is_set():
+                polled = epoll.poll(replay.poll_timeout(time.monotonic()))
+                replay.add_due_key_presses(time.monotonic())
+                for device_fd, events in polled:
+                    is_hung_up = events & (select.EPOLLHUP | select.EPOLLERR)
+                    # Once hung up there can still be plenty of events left to read, e.g. when a
+                    # replay's writer has already finished, so keep going until they run out.
+                    read = _read_device(device_fd)
+                    while read:
+                        now = time.monotonic()
+                        data = buffers[device_fd] + read
+                        consumed = len(data) - len(data) % _EVENT.size
+                        latency = _add_key_presses(data[:consumed], keymap, now, devices[device_fd])
+                        if devices[device_fd] and latency > max_latency:
+                            max_latency = latency
+                            logger.info("New max evdev delivery latency %.6fs", latency)
+                        buffers[device_fd] = data[consumed:]
+                        read = _read_device(device_fd) if is_hung_up else None
+                    if read == b"" or is_hung_up:
+                        # Unplugged, or a replay has finished.  Carry on with the other devices.
+                        _close_device(epoll, devices, device_fd)
+    except:
+        logger.exception("evdev thread died")
+        raise
+
+
+def _read_device(device_fd):
+    # Returns b"" once there will never be any more events, or None if there aren't any yet.
+    try:
+        return os.read(device_fd, _EVENT.size * _READ_EVENTS)
+    except BlockingIOError:
+        return None
+    except OSError:
+        # e.g. ENODEV once the device has been unplugged.
+        logger.warning("Unable to read input events from fd %s", device_fd, exc_info=True)
+        return b""
+
+
+def _add_key_presses(data, keymap, now, is_monotonic):
+    # Returns the longest time from the kernel seeing a key to the game seeing it.  The game takes
+    # that time off the score too, but only if the timestamps are on the same clock.
+    max_latency = 0.0
+    for key, timestamp in parse_events(data, keymap):
+        button_polling.add_key_press(key, timestamp if is_monotonic else None)
+        max_latency = max(max_latency, now - timestamp)
+    return max_latency
+
+
+class _Replay:
+    # Key presses from recorded event files, e.g. made with `cat /dev/input/event0 > recording`,
+    # replayed with the same spacing as they were recorded from when the thread starts.
+    __slots__ = ("presses", "started_at")
+
+    def __init__(self, paths, keymap):
+        presses = []
+        for path in paths:
+            recorded = read_event_file(path, keymap)
+            logger.info("Replaying %s key presses from %s", len(recorded), path)
+            presses.extend((timestamp - recorded[0][1], key) for key, timestamp in recorded)
+        # Latest first, so the next one due is always on the end.
+        self.presses = sorted(presses, reverse=True)
+        self.started_at = time.monotonic()
+
+    def poll_timeout(self, now):
+        if not self.presses:
+            return _POLL_TIMEOUT_SECONDS
+        next_due = self.started_at + self.presses[-1][0] - now
+        return max(0.0, min(_POLL_TIMEOUT_SECONDS, next_due))
+
+    def add_due_key_presses(self, now):
+        while self.presses and self.started_at + self.presses[-1][0] <= now:
+            offset, key = self.presses.pop()
+            button_polling.add_key_press(key, self.started_at + offset)
+
+
+def _close_device(epoll, devices, device_fd):
+    logger.warning("No more input events from fd %s, closing it", device_fd)
+    epoll.unregister(device_fd)
+    del devices[device_fd]
+    os.close(device_fd)
+
+
+def parse_events(data, keymap):
+    # Yields (key, kernel timestamp in seconds) for each key down event in data, which must hold
+    # whole input_event structs.  Works equally well on a recording made with e.g.
+    # `cat /dev/input/event0 > recording`.
+    for secs, usecs, type_, code, value in _EVENT.iter_unpack(data):
+        if type_ == _EV_KEY and value == _KEY_DOWN:
+            key = keymap.get(code)
+            if key is None:
+                logger.info("Ignoring unmapped key code %s", code)
+            else:
+                yield key, secs + usecs / 1_000_000
+
+
+def read_event_file(path, keymap):
+    data = pathlib.Path(path).read_bytes()
+    return list(parse_events(data[: len(data) - len(data) % _EVENT.size], keymap))
@@ -0,0 +1,452 @@
+import dataclasses
+import datetime
+import logging
+import mmap
+import os
+import pathlib
+import stat
+
+from reactions import handler, screen, states
+
+_SYS_GRAPHICS = pathlib.Path("/sys/class/graphics")
+_ATTRACT_FRAME_PERIOD = datetime.timedelta(seconds=1 / 60)
+# How long the attract block takes to cross the screen one way.
+_ATTRACT_CROSSING_SECONDS = 2
+_ZERO_TIME_DELTA = datetime.timedelta()
+
+_BACKGROUND = (0, 0, 0)
+_FOREGROUND = (255, 255, 255)
+_DIM = (128, 128, 128)
+_ACCENT = (255, 200, 0)
+
+_MESSAGE_LENGTH = 16
+_SCORE_LENGTH = 5
+
+# 5x7 bitmaps, one int per row with the most significant bit on the left.
+_FONT_WIDTH = 5
+_FONT_HEIGHT = 7
+# Each character cell has a blank column and row after the glyph, for spacing.
+_CELL_WIDTH = _FONT_WIDTH + 1
+_CELL_HEIGHT = _FONT_HEIGHT + 1
+_GLYPHS = {
+    " ": (0b00000, 0b00000, 0b00000, 0b00000, 0b00000, 0b00000, 0b00000),
+    ".": (0b00000, 0b00000, 0b00000, 0b00000, 0b00000, 0b01100, 0b01100),
+    ":": (0b00000, 0b01100, 0b01100, 0b00000, 0b01100, 0b01100, 0b00000),
+    "-": (0b00000, 0b00000, 0b00000, 0b11111, 0b00000, 0b00000, 0b00000),
+    "0": (0b01110, 0b10001, 0b10011, 0b10101, 0b11001, 0b10001, 0b01110),
+    "1": (0b00100, 0b01100, 0b00100, 0b00100, 0b00100, 0b00100, 0b01110),
+    "2": (0b01110, 0b10001, 0b00001, 0b00010, 0b00100, 0b01000, 0b11111),
+    "3": (0b11111, 0b00010, 0b00100, 0b00010, 0b00001, 0b10001, 0b01110),
+    "4": (0b00010, 0b00110, 0b01010, 0b10010, 0b11111, 0b00010, 0b00010),
+    "5": (0b11111, 0b10000, 0b11110, 0b00001, 0b00001, 0b10001, 0b01110),
+    "6": (0b00110, 0b01000, 0b10000, 0b11110, 0b10001, 0b10001, 0b01110),
+    "7": (0b11111, 0b00001, 0b00010, 0b00100, 0b01000, 0b01000, 0b01000),
+    "8": (0b01110, 0b10001, 0b10001, 0b01110, 0b10001, 0b10001, 0b01110),
+    "9": (0b01110, 0b10001, 0b10001, 0b01111, 0b00001, 0b00010, 0b01100),
+    "A": (0b01110, 0b10001, 0b10001, 0b11111, 0b10001, 0b10001, 0b10001),
+    "B": (0b11110, 0b10001, 0b10001, 0b11110, 0b10001, 0b10001, 0b11110),
+    "C": (0b01110, 0b10001, 0b10000, 0b10000, 0b10000, 0b10001, 0b01110),
+    "D": (0b11100, 0b10010, 0b10001, 0b10001, 0b10001, 0b10010, 0b11100),
+    "E": (0b11111, 0b10000, 0b10000, 0b11110, 0b10000, 0b10000, 0b11111),
+    "F": (0b11111, 0b10000, 0b10000, 0b11110, 0b10000, 0b10000, 0b10000),
+    "G": (0b01110, 0b10001, 0b10000, 0b10111, 0b10001, 0b10001, 0b01111),
+    "H": (0b10001, 0b10001, 0b10001, 0b11111, 0b10001, 0b10001, 0b10001),
+    "I": (0b01110, 0b00100, 0b00100, 0b00100, 0b00100, 0b00100, 0b01110),
+    "J": (0b00111, 0b00010, 0b00010, 0b00010, 0b00010, 0b10010, 0b01100),
+    "K": (0b10001, 0b10010, 0b10100, 0b11000, 0b10100, 0b10010, 0b10001),
+    "L": (0b10000, 0b10000, 0b10000, 0b10000, 0b10000, 0b10000, 0b11111),
+    "M": (0b10001, 0b11011, 0b10101, 0b10101, 0b10001, 0b10001, 0b10001),
+    "N": (0b10001, 0b10001, 0b11001, 0b10101, 0b10011, 0b10001, 0b10001),
+    "O": (0b01110, 0b10001, 0b10001, 0b10001, 0b10001, 0b10001, 0b01110),
+    "P": (0b11110, 0b10001, 0b10001, 0b11110, 0b10000, 0b10000, 0b10000),
+    "Q": (0b01110, 0b10001, 0b10001, 0b10001, 0b10101, 0b10010, 0b01101),
+    "R": (0b11110, 0b10001, 0b10001, 0b11110, 0b10100, 0b10010, 0b10001),
+    "S": (0b01111, 0b10000, 0b10000, 0b01110, 0b00001, 0b00001, 0b11110),
+    "T": (0b11111, 0b00100, 0b00100, 0b00100, 0b00100, 0b00100, 0b00100),
+    "U": (0b10001, 0b10001, 0b10001, 0b10001, 0b10001, 0b10001, 0b01110),
+    "V": (0b10001, 0b10001, 0b10001, 0b10001, 0b10001, 0b01010, 0b00100),
+    "W": (0b10001, 0b10001, 0b10001, 0b10101, 0b10101, 0b10101, 0b01010),
+    "X": (0b10001, 0b10001, 0b01010, 0b00100, 0b01010, 0b10001, 0b10001),
+    "Y": (0b10001, 0b10001, 0b10001, 0b01010, 0b00100, 0b00100, 0b00100),
+    "Z": (0b11111, 0b00001, 0b00010, 0b00100, 0b01000, 0b10000, 0b11111),
+}
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class Geometry:
+    width: int
+    height: int
+    bits_per_pixel: int
+    # Bytes per line, which can be more than width * bytes per pixel.
+    stride: int
+
+
+def read_geometry(path):
+    # e.g. /dev/fb0 is described by /sys/class/graphics/fb0
+    sys_path = _SYS_GRAPHICS / pathlib.Path(path).name
+    width, height = (
+        int(value) for value in (sys_path / "virtual_size").read_text(encoding="ascii").split(",")
+    )
+    return Geometry(
+        width=width,
+        height=height,
+        bits_per_pixel=int((sys_path / "bits_per_pixel").read_text(encoding="ascii")),
+        stride=int((sys_path / "stride").read_text(encoding="ascii")),
+    )
+
+
+def parse_size(size):
+    # WIDTHxHEIGHTxBITS_PER_PIXEL, for a file-backed framebuffer which has no sysfs entry.
+    try:
+        width, height, bits_per_pixel = (int(value) for value in size.lower().split("x"))
+    except ValueError as ex:
+        raise ValueError(f"Framebuffer size should be WIDTHxHEIGHTxBPP, not {size}") from ex
+    return Geometry(width, height, bits_per_pixel, width * bits_per_pixel // 8)
+
+
+def encode_colour(colour, bits_per_pixel):
+    red, green, blue = colour
+    match bits_per_pixel:
+        case 16:
+            # RGB565
+            return ((red >> 3) << 11 | (green >> 2) << 5 | blue >> 3).to_bytes(2, "little")
+        case 24:
+            return bytes((blue, green, red))
+        case 32:
+            # XRGB8888
+            return bytes((blue, green, red, 0))
+        case _:
+            raise ValueError(f"Unsupported bits per pixel: {bits_per_pixel}")
+
+
+class Surface:
+    # The framebuffer memory mapped, with everything drawn by copying whole rows of pixels in.
+    def __init__(self, path, geometry):
+        self.path = path
+        self.geometry = geometry
+        self.bytes_per_pixel = geometry.bits_per_pixel // 8
+        self.size = geometry.stride * geometry.height
+        self.descriptor = None
+        self.buffer = None
+
+    def __enter__(self):
+        self.descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        # A file standing in for the framebuffer needs to be big enough to map.
+        file_stat = os.fstat(self.descriptor)
+        if stat.S_ISREG(file_stat.st_mode) and file_stat.st_size < self.size:
+            os.ftruncate(self.descriptor, self.size)
+        self.buffer = mmap.mmap(self.descriptor, self.size)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.buffer.close()
+        os.close(self.descriptor)
+
+    def _offset(self, position):
+        left, top = position
+        return top * self.geometry.stride + left * self.bytes_per_pixel
+
+    def blit(self, position, rows):
+        offset = self._offset(position)
+        for row in rows:
+            self.buffer[offset : offset + len(row)] = row
+            offset += self.geometry.stride
+
+    def fill(self, rect, colour):
+        # The rect is (left, top, width, height).
+        left, top, width, height = rect
+        if width <= 0 or height <= 0:
+            return
+        row = colour * width
+        offset = self._offset((left, top))
+        for _ in range(height):
+            self.buffer[offset : offset + len(row)] = row
+            offset += self.geometry.stride
+
+    def clear(self, colour):
+        line = (colour * self.geometry.width).ljust(self.geometry.stride, b"\0")
+        self.buffer[:] = line * self.geometry.height
+
+
+class Font:
+    # Every glyph rendered up front at one scale and colour, as the bytes for each row of pixels in
+    # its cell, so that drawing a character is only copying rows into the framebuffer.
+    def __init__(self, scale, foreground, background, bits_per_pixel):
+        self.scale = scale
+        self.cell_width = _CELL_WIDTH * scale
+        self.cell_height = _CELL_HEIGHT * scale
+        self.lit = encode_colour(foreground, bits_per_pixel) * scale
+        self.unlit = encode_colour(background, bits_per_pixel) * scale
+        self.glyphs = {char: self._render(bitmap) for char, bitmap in _GLYPHS.items()}
+        self.blank = self.glyphs[" "]
+
+    def _render(self, bitmap):
+        rows = []
+        for bits in bitmap + (0,):
+            row = b"".join(
+                self.lit if bits >> (_FONT_WIDTH - 1 - column) & 1 else self.unlit
+                for column in range(_FONT_WIDTH)
+            )
+            # The same bytes object is repeated for each scaled line, rather than copied.
+            rows.extend([row + self.unlit] * self.scale)
+        return rows
+
+
+class TextField:
+    # A fixed run of character cells with the text centred in it.  Only the cells whose character
+    # has changed are redrawn, so a score ticking up is usually just one or two cells.
+    __slots__ = ("surface", "font", "position", "length", "drawn")
+
+    def __init__(self, surface, font, position, length):
+        self.surface = surface
+        self.font = font
+        self.position = position
+        self.length = length
+        self.drawn = [None] * length
+
+    def write(self, text):
+        text = text.center(self.length)
+        left, top = self.position
+        for index in range(self.length):
+            char = text[index]
+            if char != self.drawn[index]:
+                self.surface.blit(
+                    (left + index * self.font.cell_width, top),
+                    self.font.glyphs.get(char, self.font.blank),
+                )
+                self.drawn[index] = char
+
+    def width(self):
+        return self.length * self.font.cell_width
+
+
+class ScoreField(TextField):
+    # Remembers the score drawn as centiseconds, so it's only formatted when what's shown changes.
+    __slots__ = ("centi_secs",)
+
+    def __init__(self, surface, font, position, length):
+        super().__init__(surface, font, position, length)
+        self.centi_secs = None
+
+    def write_score(self, score, prefix=""):
+        centi_secs = screen.score_as_centi_secs(score)
+        if centi_secs != self.centi_secs:
+            self.centi_secs = centi_secs
+            self.write(prefix + _format_score(score))
+
+
+class _Attract:
+    # A block bouncing back and forth along a band at the bottom of the screen.  Where the block is
+    # follows from how long it has been running, so only the time needs to be kept.
+    __slots__ = ("surface", "band", "block_width", "colours", "elapsed", "is_on")
+
+    def __init__(self, surface, band, block_width, colours):
+        self.surface = surface
+        # (left, top, width, height) of the whole band.
+        self.band = band
+        self.block_width = block_width
+        # The block's colour and the background, already encoded.
+        self.colours = colours
+        self.elapsed = _ZERO_TIME_DELTA
+        self.is_on = False
+
+    def start(self):
+        if self.is_on:
+            return
+        self.is_on = True
+        self.elapsed = _ZERO_TIME_DELTA
+        block_x = self._block_x()
+        self._fill_span(block_x, block_x + self.block_width, self.colours[0])
+
+    def stop(self):
+        if not self.is_on:
+            return
+        self.is_on = False
+        block_x = self._block_x()
+        self._fill_span(block_x, block_x + self.block_width, self.colours[1])
+
+    def step(self, time_elapsed):
+        old_x = self._block_x()
+        self.elapsed += time_elapsed
+        new_x = self._block_x()
+        width = self.block_width
+        colour, background = self.colours
+
+        # Only the strips uncovered and newly covered are drawn, and the two never overlap, so the
+        # block doesn't flicker.
+        if new_x >= old_x:
+            self._fill_span(old_x, min(old_x + width, new_x), background)
+            self._fill_span(max(new_x, old_x + width), new_x + width, colour)
+        else:
+            self._fill_span(max(old_x, new_x + width), old_x + width, background)
+            self._fill_span(new_x, min(new_x + width, old_x), colour)
+
+    def _block_x(self):
+        left, _, band_width, _ = self.band
+        travel = max(0, band_width - self.block_width)
+        if not travel:
+            return left
+
+        # A triangle wave, so the block goes back and forth across the band.
+        distance = round(self.elapsed.total_seconds() / _ATTRACT_CROSSING_SECONDS * travel) % (
+            2 * travel
+        )
+        if distance > travel:
+            distance = 2 * travel - distance
+        return left + distance
+
+    def _fill_span(self, start_x, end_x, colour):
+        _, top, _, height = self.band
+        self.surface.fill((start_x, top, end_x - start_x, height), colour)
+
+
+class Framebuffer(handler.Handler):
+    subscriptions = handler.SCORE_SUBSCRIPTIONS
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.high_score = None
+        self.current_score = None
+        self.target = None
+        self.message = None
+        self.attract = None
+        self.is_main_drawn = False
+
+    def __enter__(self):
+        self.surface.__enter__()
+        geometry = self.surface.geometry
+        background = encode_colour(_BACKGROUND, geometry.bits_per_pixel)
+        self.surface.clear(background)
+
+        # Scale the fonts to whatever the display is, big enough for the score and target key to
+        # be read from across a room.
+        big_scale = max(
+            1,
+            min(
+                geometry.width // (_CELL_WIDTH * (_SCORE_LENGTH + 2)),
+                geometry.height // (_CELL_HEIGHT * 4),
+            ),
+        )
+        small_scale = max(
+            1,
+            min(
+                geometry.width // (_CELL_WIDTH * (_MESSAGE_LENGTH + 4)),
+                geometry.height // (_CELL_HEIGHT * 12),
+            ),
+        )
+        big = Font(big_scale, _FOREGROUND, _BACKGROUND, geometry.bits_per_pixel)
+        accent = Font(big_scale, _ACCENT, _BACKGROUND, geometry.bits_per_pixel)
+        small = Font(small_scale, _FOREGROUND, _BACKGROUND, geometry.bits_per_pixel)
+        dim = Font(small_scale, _DIM, _BACKGROUND, geometry.bits_per_pixel)
+
+        # Top to bottom: high score, current score, target key, message and the attract band, with
+        # the space left over shared out evenly between them.
+        attract_height = small.cell_height // 2
+        heights = (
+            dim.cell_height,
+            big.cell_height,
+            accent.cell_height,
+            small.cell_height,
+            attract_height,
+        )
+        gap = max(0, (geometry.height - sum(heights)) // (len(heights) + 1))
+        tops = []
+        top = gap
+        for height in heights:
+            tops.append(top)
+            top += height + gap
+
+        self.high_score = self._centred_field(dim, tops[0], _MESSAGE_LENGTH, ScoreField)
+        self.current_score = self._centred_field(big, tops[1], _SCORE_LENGTH, ScoreField)
+        self.target = self._centred_field(accent, tops[2], 1)
+        self.message = self._centred_field(small, tops[3], _MESSAGE_LENGTH)
+
+        # The attract band runs under the message.
+        self.attract = _Attract(
+            self.surface,
+            (self.message.position[0], tops[4], self.message.width(), attract_height),
+            small.cell_width,
+            (encode_colour(_ACCENT, geometry.bits_per_pixel), background),
+        )
+
+        logger.info("Framebuffer %s, big font x%s, small x%s", geometry, big_scale, small_scale)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.surface.clear(encode_colour(_BACKGROUND, self.surface.geometry.bits_per_pixel))
+        self.surface.__exit__(exc_type, exc_val, exc_tb)
+
+    def _centred_field(self, font, top, length, field_type=TextField):
+        left = max(0, (self.surface.geometry.width - length * font.cell_width) // 2)
+        return field_type(self.surface, font, (left, top), length)
+
+    def refresh(self, state, is_state_change, time_elapsed):
+        match state:
+            case states.NotStarted(high_score=high_score):
+                self._write_scores(screen.ZERO_TIME_DELTA, high_score)
+            case states.GameAboutToStart(high_score=high_score):
+                self._write_scores(screen.ZERO_TIME_DELTA, high_score)
+            case states.CoolDown(high_score=high_score, current_score=current_score):
+                self._write_scores(current_score, high_score)
+            case states.WaitingOnButton(high_score=high_score, current_score=current_score):
+                self._write_scores(current_score, high_score)
+            case states.GameFinishedCoolDown(high_score=high_score, current_score=current_score):
+                self._write_scores(current_score, high_score)
+            case states.GameFinished(high_score=high_score, current_score=current_score):
+                self._write_scores(current_score, high_score)
+            case _:
+                raise NotImplementedError(state)
+
+        # The rest only depends on fields which are fixed for the lifetime of each state.
+        if is_state_change or not self.is_main_drawn:
+            self._write_main(state)
+        if self.attract.is_on:
+            self.attract.step(time_elapsed)
+
+    def wake_up_after(self):
+        if self.attract.is_on:
+            return _ATTRACT_FRAME_PERIOD
+        return None
+
+    def _write_scores(self, current_score, high_score):
+        self.current_score.write_score(current_score)
+        self.high_score.write_score(high_score, prefix="HIGH ")
+
+    def _write_main(self, state):
+        match state:
+            case states.NotStarted():
+                self._write_message("PRESS N TO PLAY", "", is_attract=True)
+            case states.GameAboutToStart():
+                self._write_message("GET READY", "", is_attract=False)
+            case states.CoolDown():
+                self._write_message("GET READY", "", is_attract=False)
+            case states.WaitingOnButton(button=button):
+                self._write_message("PRESS", button.key, is_attract=False)
+            case states.GameFinishedCoolDown():
+                self._write_message("GAME OVER", "", is_attract=False)
+            case states.GameFinished():
+                self._write_message("PRESS N TO PLAY", "", is_attract=True)
+            case _:
+                raise NotImplementedError(state)
+
+    def _write_message(self, message, target, is_attract):
+        self.message.write(message)
+        self.target.write(target)
+        self.is_main_drawn = True
+
+        if is_attract:
+            self.attract.start()
+        else:
+            self.attract.stop()
+
+
+def _format_score(score):
+    return screen.format_score(score).replace(":", ".")
+
+
+def framebuffer(path, size=None):
+    # Without a size the geometry comes from sysfs, which only real framebuffer devices have.
+    geometry = parse_size(size) if size else read_geometry(path)
+    return Framebuffer(Surface(path, geometry))
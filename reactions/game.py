@@ -2,9 +2,11 @@ import argparse
 import contextlib
 import dataclasses
 import datetime
+import functools
 import logging
 import logging.handlers
 import math
+import pathlib
 import random
 import sys
 import time
@@ -14,13 +16,23 @@ import gpiozero
 import pydub
 
 from reactions import (
+    bench,
     button_lights,
     button_polling,
+    calibration,
+    emulator,
+    evdev_input,
+    framebuffer,
+    gc_control,
+    handler,
     high_score,
+    profiler,
     screen,
     segment_display,
     sound,
+    spectator,
     states,
+    tournament,
 )
 
 _ROUNDS = 25
@@ -35,6 +47,7 @@ _NEW_GAME_KEY = "N"
 _GAME_ABOUT_TO_START_DURATION = datetime.timedelta(seconds=3)
 _GAME_FINISHED_COOLDOWN_DURATION = datetime.timedelta(seconds=3)
 _INCORRECT_BUTTON_PRESS_PENALTY = datetime.timedelta(seconds=2)
+_NO_LATENCY_CORRECTION = datetime.timedelta()
 
 logger = logging.getLogger(__name__)
 
@@ -79,21 +92,25 @@ class Buttons:
     buttons_by_key: Dict[str, _Button]
 
 
+# Key, sound, LED pin and button pin for each in game button.
+_IN_GAME_BUTTONS = [
+    ("Q", "c.wav", 13, 10),
+    ("W", "d.wav", 19, 22),
+    ("E", "e.wav", 26, 9),
+    ("A", "g.wav", 6, 17),
+    ("S", "a.wav", 5, 27),
+    ("D", "b.wav", 11, 4),
+]
+
+
 @contextlib.contextmanager
-def create_buttons(is_rpi):
-    in_game_buttons = [
-        new_button(is_rpi, "Q", "c.wav", 13, 10),
-        new_button(is_rpi, "W", "d.wav", 19, 22),
-        new_button(is_rpi, "E", "e.wav", 26, 9),
-        new_button(is_rpi, "A", "g.wav", 6, 17),
-        new_button(is_rpi, "S", "a.wav", 5, 27),
-        new_button(is_rpi, "D", "b.wav", 11, 4),
-    ]
+def create_buttons(is_rpi, poll=True):
+    in_game_buttons = [new_button(is_rpi, *definition) for definition in _IN_GAME_BUTTONS]
     new_game_button = new_button(is_rpi, _NEW_GAME_KEY, "c-high.wav", None, 14)
 
     try:
         buttons_by_key = {button.key: button for button in in_game_buttons + [new_game_button]}
-        if is_rpi:
+        if is_rpi and poll:
             with button_polling.polling_thread(
                 in_game_buttons + [new_game_button],
                 _BUTTON_POLL_TICK_PERIOD_SECONDS,
@@ -108,6 +125,15 @@ def create_buttons(is_rpi):
                 button.rpi_button.close()
 
 
+def virtual_buttons():
+    # Buttons with no sound or hardware, for running state machines on behalf of other cabinets.
+    in_game_buttons = [
+        _Button(key=key, audio_segment=None, led=None, rpi_button=None)
+        for key, *_ in _IN_GAME_BUTTONS
+    ]
+    return Buttons(in_game_buttons, {button.key: button for button in in_game_buttons})
+
+
 def shuffled_buttons(buttons: Buttons):
     while True:
         pool = buttons.in_game_buttons + buttons.in_game_buttons
@@ -115,46 +141,117 @@ def shuffled_buttons(buttons: Buttons):
         yield from pool
 
 
-def main_loop(stdscr, is_rpi, enable_screen):  # pylint: disable=too-many-locals
-    handlers = []
+def main_loop(stdscr, args):  # pylint: disable=too-many-locals
+    dispatcher = handler.Dispatcher()
 
     with contextlib.ExitStack() as exit_stack:
-        buttons = exit_stack.enter_context(create_buttons(is_rpi))
+        exit_stack.callback(dispatcher.log_stats)
+        buttons = exit_stack.enter_context(create_buttons(args.rpi))
+        if args.evdev:
+            exit_stack.enter_context(
+                evdev_input.reading_thread(evdev_input.device_paths(args.evdev), args.evdev_keymap)
+            )
         wave_objects = sound.WaveObjects()
 
-        def register(handler):
-            handlers.append(exit_stack.enter_context(handler))
+        def register(handler_):
+            dispatcher.add(exit_stack.enter_context(handler_))
 
-        register(screen.new_screen(stdscr, enable_screen))
-        register(segment_display.displays(is_rpi))
-        register(button_lights.button_lights(buttons, is_rpi))
+        for handler_ in output_handlers(stdscr, args, buttons) + background_handlers(args, buttons):
+            register(handler_)
 
         shuffled_buttons_iter = iter(shuffled_buttons(buttons))
 
-        last_tick = time.time_ns()
         state = states.NotStarted(
             high_score=high_score.read_high_score(default_high_score=_DEFAULT_HIGH_SCORE)
         )
+        latency_correction = calibration.read_correction()
+        logger.info("Taking %s off every press for lamp and input latency", latency_correction)
+        if args.tournament:
+            remote = exit_stack.enter_context(
+                tournament.client(
+                    args.tournament,
+                    args.game_id,
+                    buttons.buttons_by_key,
+                    latency_correction,
+                    wave_objects,
+                )
+            )
+        else:
+            remote = None
+        # Reused on every tick, rather than allocating a new list each time.
+        keys = []
+
+        gc_control.freeze()
+        last_tick = time.monotonic_ns()
         while True:
-            button_polling.check_polling_thread_alive()
+            button_polling.supervise_polling_thread()
+            evdev_input.check_reading_thread_alive()
 
             last_tick, time_elapsed = calculate_time_elapsed(last_tick)
 
-            keys, is_exit = read_keys(stdscr)
+            is_exit, pressed_at = read_keys(stdscr, keys)
             if is_exit:
                 break
 
             play_sounds(buttons, keys)
-            is_state_change, state = advance_state(
-                state, keys, time_elapsed, shuffled_buttons_iter, wave_objects
-            )
+            if remote:
+                # The tournament host runs the state machine, and applies the calibrated latency
+                # correction to the round time sent with the keys.
+                is_state_change, state = remote.advance_state(
+                    state, keys, time_elapsed, input_delay(last_tick, pressed_at)
+                )
+            else:
+                is_state_change, state = advance_state(
+                    state,
+                    keys,
+                    time_elapsed,
+                    shuffled_buttons_iter,
+                    wave_objects,
+                    press_correction(latency_correction, last_tick, pressed_at),
+                    _log_emulated_high_score if args.emulate else high_score.save_high_score,
+                )
 
-            for handler in handlers:
-                handler.refresh(state, is_state_change, time_elapsed)
+            dispatcher.dispatch(state, is_state_change, time_elapsed)
+            if is_state_change and isinstance(state, states.GameFinished):
+                dispatcher.log_stats()
+            if dispatcher.is_finished():
+                logger.info("Finished")
+                break
 
             time.sleep(_MAIN_LOOP_TICK_PERIOD_SECONDS)
 
 
+def output_handlers(stdscr, args, buttons):
+    # Everything the player sees, in the order it's refreshed on each tick.
+    handlers = [
+        screen.new_screen(stdscr, stdscr is not None),
+        segment_display.displays(args.rpi, emulator.FakeTM1637 if args.emulate else None),
+    ]
+    if args.framebuffer:
+        handlers.append(framebuffer.framebuffer(args.framebuffer, args.framebuffer_size))
+    handlers.append(button_lights.button_lights(buttons, args.rpi))
+    return handlers
+
+
+def background_handlers(args, buttons):
+    # Everything else, refreshed after the output handlers so they see what was drawn.
+    handlers = []
+    if args.emulate:
+        handlers.append(
+            emulator.scripted_player(buttons, args.emulate_reaction_ms, args.emulate_games)
+        )
+    if args.spectator_port:
+        handlers.append(
+            spectator.spectator(args.spectator_bind, args.spectator_port, args.spectator_rate)
+        )
+    handlers.append(gc_control.GcControl())
+    if args.alloc_stats:
+        handlers.append(gc_control.AllocationStats())
+    if args.profile:
+        handlers.append(profiler.profiler(args.profile_games, args.profile_minutes))
+    return handlers
+
+
 def play_sounds(buttons, keys):
     for key in keys:
         button = buttons.buttons_by_key.get(key, None)
@@ -163,24 +260,63 @@ def play_sounds(buttons, keys):
 
 
 def calculate_time_elapsed(last_tick):
-    this_tick = time.time_ns()
-    time_elapsed = datetime.timedelta(microseconds=(this_tick - last_tick) / 1000)
-    last_tick = this_tick
-    return last_tick, time_elapsed
+    this_tick = time.monotonic_ns()
+    time_elapsed = datetime.timedelta(microseconds=(this_tick - last_tick) // 1000)
+    return this_tick, time_elapsed
 
 
-def read_keys(stdscr):
-    keys = []
+def read_keys(stdscr, keys):
+    # Returns whether to exit, and when the first key was pressed if the input knows.
+    keys.clear()
     if stdscr:
         is_exit = screen.read_keys(stdscr, keys)
     else:
         is_exit = False
-    button_polling.read_keys(keys)
-    return keys, is_exit
-
-
-def advance_state(state, keys, time_elapsed, shuffled_buttons_iter, wave_objects):
-    new_state = calculate_next_state(state, keys, time_elapsed, shuffled_buttons_iter, wave_objects)
+    # Keys from curses come first and have no timestamp.
+    is_untimed = bool(keys)
+    pressed_at = button_polling.read_keys(keys)
+    return is_exit, None if is_untimed else pressed_at
+
+
+def _log_emulated_high_score(score):
+    # An emulated game is played by a script, so its score mustn't replace a real player's.
+    logger.info("Not saving emulated high score %s", score)
+
+
+def press_correction(latency_correction, this_tick, pressed_at):
+    # The calibrated correction, plus the input delay when it's known.
+    if pressed_at is None:
+        return latency_correction
+    return latency_correction + input_delay(this_tick, pressed_at)
+
+
+def input_delay(this_tick, pressed_at):
+    # How long before this tick the first key was really pressed, for inputs which timestamp their
+    # events, so those presses aren't scored at tick resolution.
+    if pressed_at is None:
+        return _NO_LATENCY_CORRECTION
+    delay_us = max(0, this_tick // 1000 - round(pressed_at * 1_000_000))
+    return datetime.timedelta(microseconds=delay_us)
+
+
+def advance_state(
+    state,
+    keys,
+    time_elapsed,
+    shuffled_buttons_iter,
+    wave_objects,
+    latency_correction=_NO_LATENCY_CORRECTION,
+    save_high_score=high_score.save_high_score,
+):  # pylint: disable=too-many-arguments
+    new_state = calculate_next_state(
+        state,
+        keys,
+        time_elapsed,
+        shuffled_buttons_iter,
+        wave_objects,
+        latency_correction,
+        save_high_score,
+    )
     is_state_change = type(new_state) != type(state)  # pylint: disable=unidiomatic-typecheck
 
     if is_state_change:
@@ -190,8 +326,14 @@ def advance_state(state, keys, time_elapsed, shuffled_buttons_iter, wave_objects
 
 
 def calculate_next_state(
-    state, keys, time_elapsed, shuffled_buttons_iter, wave_objects
-):  # pylint: disable=too-many-return-statements
+    state,
+    keys,
+    time_elapsed,
+    shuffled_buttons_iter,
+    wave_objects,
+    latency_correction=_NO_LATENCY_CORRECTION,
+    save_high_score=high_score.save_high_score,
+):  # pylint: disable=too-many-return-statements,too-many-arguments,too-many-locals
     match state:
         case states.NotStarted(high_score=high_score_):
             # The game hasn't started yet.  When someone hits the new game key, start a new game.
@@ -224,6 +366,7 @@ def calculate_next_state(
                     round_=0,
                     button=next(shuffled_buttons_iter),
                     current_score=datetime.timedelta(),
+                    round_start_score=datetime.timedelta(),
                 )
             state.elapsed = new_elapsed
             return state
@@ -245,19 +388,26 @@ def calculate_next_state(
                     round_=round_,
                     button=next(shuffled_buttons_iter),
                     current_score=current_score,
+                    round_start_score=current_score,
                 )
 
             state.elapsed = new_elapsed
             return state
 
         case states.WaitingOnButton(
-            high_score=high_score_, current_score=current_score, round_=round_, button=button
+            high_score=high_score_,
+            current_score=current_score,
+            round_=round_,
+            button=button,
+            round_start_score=round_start_score,
         ):
             # Waiting for someone to hit the right button.
             # * If the game has taken longer than _TIMEOUT_SECS then go to NotStarted (GameFinished
             #   of GameFinishedCoolDown make less sense as there is no sensible last score).
             # * If someone managed to hit two keys at once then they are a superhuman, so don't
             #   worry about this and just look at the first key.
+            # * Take the cabinet's calibrated lamp and input latency off the score, but never more
+            #   than the time spent waiting in this round.
             # * If the key is wrong then add a penalty to the current score.
             # * If we've had enough rounds then save the high score and finish the game with
             #   GameFinishedCoolDown, otherwise enter CoolDown.
@@ -267,6 +417,8 @@ def calculate_next_state(
                 return states.NotStarted(high_score=high_score_)
 
             if keys:
+                current_score -= min(latency_correction, current_score - round_start_score)
+
                 first_key = keys[0]
                 if first_key != button.key:
                     sound.try_play_audio(wave_objects.incorrect_button_press)
@@ -278,7 +430,7 @@ def calculate_next_state(
                 if round_ == _ROUNDS - 1:
                     if current_score < high_score_:
                         high_score_ = current_score
-                        high_score.save_high_score(high_score_)
+                        save_high_score(high_score_)
                     else:
                         high_score_ = state.high_score
 
@@ -328,16 +480,193 @@ def cool_down(round_: int, high_score_: datetime.timedelta, current_score: datet
     )
 
 
+def run_calibration(args):
+    with create_buttons(args.rpi) as buttons, contextlib.ExitStack() as exit_stack:
+        dispatcher = handler.Dispatcher()
+        for handler_ in output_handlers(None, args, buttons):
+            dispatcher.add(exit_stack.enter_context(handler_))
+        calibration.calibrate(
+            buttons,
+            _CalibrationRounds(dispatcher),
+            args.key.upper(),
+            args.samples,
+            _MAIN_LOOP_TICK_PERIOD_SECONDS,
+        )
+
+
+class _CalibrationRounds:
+    # Takes the state machine and the output handlers through the same ticks as a round in the
+    # game, so that calibration times the lamp through everything that's refreshed before it.
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def end_round(self):
+        self.dispatcher.dispatch(self._cool_down(), True, datetime.timedelta())
+
+    def start_round(self, button):
+        # The tick on which the cool down ends: the next button is chosen, then every handler is
+        # refreshed, just as in main_loop.
+        is_state_change, state = advance_state(
+            self._cool_down(),
+            [],
+            _MIN_COOLDOWN_DELAY,
+            iter([button]),
+            sound.SilentWaveObjects(),
+        )
+        self.dispatcher.dispatch(state, is_state_change, _MIN_COOLDOWN_DELAY)
+
+    @staticmethod
+    def _cool_down():
+        return states.CoolDown(
+            high_score=_DEFAULT_HIGH_SCORE,
+            round_=1,
+            delay=_MIN_COOLDOWN_DELAY,
+            elapsed=datetime.timedelta(),
+            current_score=datetime.timedelta(),
+        )
+
+
+def run_bench(args):
+    # No poll thread, so that it doesn't compete with the button read benchmark.
+    with create_buttons(args.rpi, poll=False) as buttons:
+        bench.run(
+            buttons,
+            segment_display.new_devices(emulator.FakeTM1637 if args.emulate else None),
+            args.output or bench.default_output_path(),
+            args.baseline,
+            args.screen,
+        )
+
+
+def run_host(args):
+    buttons = virtual_buttons()
+    host = tournament.Host(
+        tournament.host_transport(args.bind),
+        functools.partial(advance_state, wave_objects=sound.SilentWaveObjects()),
+        lambda: iter(shuffled_buttons(buttons)),
+        high_score.read_high_score(default_high_score=_DEFAULT_HIGH_SCORE),
+    )
+    try:
+        host.run(_MAIN_LOOP_TICK_PERIOD_SECONDS)
+    finally:
+        host.log_stats()
+        host.transport.close()
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--rpi", action=argparse.BooleanOptionalAction)
     parser.add_argument("--screen", action=argparse.BooleanOptionalAction, default=True)
-    args = parser.parse_args()
-    return args.rpi, args.screen
+    parser.add_argument(
+        "--emulate",
+        action="store_true",
+        help="Run the Raspberry Pi code against emulated pins and displays, with a scripted player",
+    )
+    parser.add_argument(
+        "--emulate-reaction-ms",
+        type=float,
+        default=250,
+        help="How long the scripted player takes to press a button after its lamp lights",
+    )
+    parser.add_argument(
+        "--emulate-games",
+        type=int,
+        default=3,
+        help="How many games the scripted player plays before exiting",
+    )
+    parser.add_argument(
+        "--evdev",
+        action="append",
+        metavar="DEVICE",
+        help="Also read keys from this input device, e.g. a USB encoder.  Globs are expanded.",
+    )
+    parser.add_argument(
+        "--evdev-keymap",
+        type=evdev_input.parse_keymap,
+        default=evdev_input.DEFAULT_KEYMAP,
+        help="Map input event key codes to game keys, e.g. 288=Q,289=W,290=E",
+    )
+    parser.add_argument(
+        "--tournament",
+        metavar="ADDRESS",
+        help="Play as one cabinet of a tournament host, at udp:HOST:PORT or unix:PATH",
+    )
+    parser.add_argument(
+        "--game-id", type=int, default=1, help="This cabinet's game on the tournament host"
+    )
+    parser.add_argument(
+        "--framebuffer",
+        help="Draw the scores and target key straight to this framebuffer, e.g. /dev/fb0",
+    )
+    parser.add_argument(
+        "--framebuffer-size",
+        help="WIDTHxHEIGHTxBPP, for a file standing in for a framebuffer which has no sysfs entry",
+    )
+    parser.add_argument(
+        "--spectator-port",
+        type=int,
+        help="Serve a live view of the game for spectators over HTTP on this port",
+    )
+    parser.add_argument("--spectator-bind", default="0.0.0.0")
+    parser.add_argument(
+        "--spectator-rate",
+        type=float,
+        default=10,
+        help="How many times a second score updates are sent to spectators",
+    )
+    parser.add_argument(
+        "--alloc-stats",
+        action="store_true",
+        help="Trace how much each tick of the main loop allocates, which slows it down a lot",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample the stacks of all threads and write them out next to reactions.log, or to the "
+        "home directory when logging to stdout",
+    )
+    parser.add_argument(
+        "--profile-games", type=int, default=3, help="Stop profiling after this many games"
+    )
+    parser.add_argument(
+        "--profile-minutes", type=float, default=30, help="Stop profiling after this many minutes"
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+    calibrate_parser = subparsers.add_parser(
+        "calibrate",
+        help="Measure this cabinet's lamp and input latency, and take it off every score",
+    )
+    calibrate_parser.add_argument(
+        "--key", default="Q", help="The button with the sensor and loopback wire attached"
+    )
+    calibrate_parser.add_argument("--samples", type=int, default=50)
+    bench_parser = subparsers.add_parser(
+        "bench", help="Measure the rate and latency of each device, and write a JSON report"
+    )
+    bench_parser.add_argument("--output", type=pathlib.Path, help="Where to write the report")
+    bench_parser.add_argument(
+        "--baseline", type=pathlib.Path, help="A previous report to compare the results against"
+    )
+    host_parser = subparsers.add_parser(
+        "host", help="Run the games of several cabinets, which connect with --tournament"
+    )
+    host_parser.add_argument(
+        "--bind", default="udp:0.0.0.0:5151", help="udp:HOST:PORT or unix:PATH to listen on"
+    )
+    return parser.parse_args()
 
 
 def main():
-    is_rpi, enable_screen = parse_args()
+    args = parse_args()
+    # Subcommands log to stdout rather than running the game on screen.  Calibrate and bench are
+    # always about the cabinet's hardware.
+    enable_screen = args.screen and args.command is None
+    if args.command in ("calibrate", "bench"):
+        args.rpi = True
+    if args.emulate:
+        emulator.install()
+        args.rpi = True
 
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
@@ -351,12 +680,18 @@ def main():
 
     try:
         logger.info("Starting up!")
-        if enable_screen:
+        if args.command == "calibrate":
+            run_calibration(args)
+        elif args.command == "bench":
+            run_bench(args)
+        elif args.command == "host":
+            run_host(args)
+        elif enable_screen:
             # Ideally this wrapper would be part of the Screen class, but that seems to be a huge
             # pain to do in practise so ¯\_(ツ)_/¯
-            screen.wrapper(lambda stdscr: main_loop(stdscr, is_rpi, enable_screen))
+            screen.wrapper(lambda stdscr: main_loop(stdscr, args))
         else:
-            main_loop(None, is_rpi, enable_screen)
+            main_loop(None, args)
     except KeyboardInterrupt:
         logger.info("KeyboardInterrupt", exc_info=True)
     except:
@@ -0,0 +1,120 @@
+import gc
+import logging
+import tracemalloc
+
+from reactions import handler, states
+
+logger = logging.getLogger(__name__)
+
+
+def freeze():
+    # Everything allocated during startup (audio segments, gpiozero devices, curses windows...)
+    # lives for the lifetime of the process.  Collect once and then move it all into the permanent
+    # generation so that later collections don't have to keep traversing it.
+    gc.collect()
+    gc.freeze()
+    logger.info("Froze %s objects into the permanent generation", gc.get_freeze_count())
+
+
+# Keep the cyclic garbage collector away from the player's score.  Collection is suspended from the
+# moment a game is about to start.  The young generations are collected during each CoolDown, where
+# a pause only lengthens the random delay, and a full collection is run once the game is over.
+class GcControl(handler.Handler):
+    subscriptions = {}
+
+    def __init__(self):
+        self.was_enabled = gc.isenabled()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.was_enabled:
+            gc.enable()
+
+    def refresh(self, state, is_state_change, time_elapsed):
+        if not is_state_change:
+            return
+
+        match state:
+            case states.GameAboutToStart():
+                gc.disable()
+            case states.CoolDown():
+                gc.collect(1)
+            case states.GameFinishedCoolDown() | states.GameFinished() | states.NotStarted():
+                gc.collect()
+                if self.was_enabled:
+                    gc.enable()
+
+
+# Measure how much each tick of the main loop allocates, grouped by state, using tracemalloc.  Two
+# figures are kept for each tick: the peak traced memory above where the tick started, which catches
+# objects that are allocated and freed again within the tick, and the net change, which is what
+# survives it.  Neither is a count of allocations, as a block which is freed before the next one is
+# allocated doesn't raise the peak, but any tick which allocates at all shows up in
+# ticks_with_allocation.  Tracing slows everything down a lot, so this is only for diagnosis.  The
+# totals are logged and reset when a game ends.
+class AllocationStats(handler.Handler):
+    # Needs to see every tick.
+    subscriptions = None
+
+    def __init__(self):
+        self.stats = {}
+        self.tick_start = None
+
+    def __enter__(self):
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.log_and_reset()
+        tracemalloc.stop()
+
+    def refresh(self, state, is_state_change, time_elapsed):
+        # Read everything first and reset the peak last, so that this handler's own allocations
+        # are freed before the next tick's measurement starts.
+        current, peak = tracemalloc.get_traced_memory()
+
+        # Skip the tick on which the state changed, as it's expected to allocate a new state.
+        if self.tick_start is not None and not is_state_change:
+            name = type(state).__name__
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = _AllocationStat()
+            stat.add(peak - self.tick_start, current - self.tick_start)
+
+        if is_state_change and isinstance(state, (states.GameFinishedCoolDown, states.NotStarted)):
+            self.log_and_reset()
+
+        self.tick_start = current
+        tracemalloc.reset_peak()
+
+    def log_and_reset(self):
+        for name, stat in self.stats.items():
+            logger.info(
+                "Allocations in %s: ticks=%s, ticks_with_allocation=%s, max_peak_bytes=%s, "
+                "retained_bytes=%+d",
+                name,
+                stat.ticks,
+                stat.ticks_with_allocation,
+                stat.max_peak_bytes,
+                stat.retained_bytes,
+            )
+        self.stats.clear()
+
+
+class _AllocationStat:
+    __slots__ = ("ticks", "ticks_with_allocation", "max_peak_bytes", "retained_bytes")
+
+    def __init__(self):
+        self.ticks = 0
+        self.ticks_with_allocation = 0
+        self.max_peak_bytes = 0
+        self.retained_bytes = 0
+
+    def add(self, peak_bytes, retained_bytes):
+        self.ticks += 1
+        if peak_bytes > 0:
+            self.ticks_with_allocation += 1
+        self.max_peak_bytes = max(self.max_peak_bytes, peak_bytes)
+        self.retained_bytes += retained_bytes
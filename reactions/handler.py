@@ -1,7 +1,30 @@
-from typing import Protocol
+import datetime
+import logging
+from typing import Dict, Optional, Protocol, Tuple
+
+from reactions import states
+
+logger = logging.getLogger(__name__)
+
+ZERO_TIME_DELTA = datetime.timedelta()
+
+# For handlers which show the scores, and otherwise only change with the type of the state.
+SCORE_SUBSCRIPTIONS = {
+    states.NotStarted: ("high_score",),
+    states.GameAboutToStart: ("high_score",),
+    states.CoolDown: ("high_score", "current_score"),
+    states.WaitingOnButton: ("high_score", "current_score"),
+    states.GameFinishedCoolDown: ("high_score", "current_score"),
+    states.GameFinished: ("high_score", "current_score"),
+}
 
 
 class Handler(Protocol):
+    # The state fields each handler depends on, keyed by state type.  A handler is always refreshed
+    # when the type of the state changes, and otherwise only when one of the fields listed for the
+    # current state type changes.  None means refresh on every tick.
+    subscriptions: Optional[Dict[type, Tuple[str, ...]]] = None
+
     def __enter__(self) -> "Handler":
         ...
 
@@ -11,8 +34,20 @@ class Handler(Protocol):
     def refresh(self, state, is_state_change, time_elapsed):
         ...
 
+    def wake_up_after(self) -> Optional[datetime.timedelta]:
+        # Called after each refresh.  If this returns a time, the handler is refreshed again once
+        # that much time has passed, even if none of its subscriptions changed.
+        return None
+
+    def is_finished(self) -> bool:
+        # Checked after every tick.  Once any handler is finished, the main loop stops and shuts
+        # everything down as usual.
+        return False
+
 
 class StubHandler(Handler):
+    subscriptions = {}
+
     def __enter__(self):
         return self
 
@@ -21,3 +56,105 @@ class StubHandler(Handler):
 
     def refresh(self, *args, **kwargs):
         pass
+
+
+class Dispatcher:
+    def __init__(self):
+        self.subscribers = []
+
+    def add(self, handler):
+        self.subscribers.append(_Subscriber(handler))
+
+    def dispatch(self, state, is_state_change, time_elapsed):
+        for subscriber in self.subscribers:
+            subscriber.dispatch(state, is_state_change, time_elapsed)
+
+    def is_finished(self):
+        for subscriber in self.subscribers:
+            if subscriber.handler.is_finished():
+                return True
+        return False
+
+    def log_stats(self):
+        for subscriber in self.subscribers:
+            stats = subscriber.stats
+            logger.info(
+                "Dispatch %s: refreshed=%s, skipped=%s, by_state_change=%s, by_subscription=%s, "
+                "by_timer=%s",
+                type(subscriber.handler).__name__,
+                stats.refreshed,
+                stats.skipped,
+                stats.by_state_change,
+                stats.by_subscription,
+                stats.by_timer,
+            )
+
+    def stats(self):
+        return {
+            type(subscriber.handler).__name__: subscriber.stats.as_dict()
+            for subscriber in self.subscribers
+        }
+
+
+class _SubscriberStats:
+    # How often a handler was refreshed, and why, or skipped.
+    __slots__ = ("refreshed", "skipped", "by_state_change", "by_subscription", "by_timer")
+
+    def __init__(self):
+        self.refreshed = 0
+        self.skipped = 0
+        self.by_state_change = 0
+        self.by_subscription = 0
+        self.by_timer = 0
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class _Subscriber:
+    __slots__ = ("handler", "fields", "values", "wake_up", "time_elapsed", "stats")
+
+    def __init__(self, handler):
+        self.handler = handler
+        # The subscribed fields of the current state type, and their values at the last refresh.
+        self.fields = ()
+        self.values = []
+        # Time remaining until the handler asked to be woken up, or None.
+        self.wake_up = None
+        # Time elapsed since the last refresh, which is what the handler is given when refreshed.
+        self.time_elapsed = ZERO_TIME_DELTA
+        self.stats = _SubscriberStats()
+
+    def dispatch(self, state, is_state_change, time_elapsed):
+        subscriptions = self.handler.subscriptions
+        stats = self.stats
+        self.time_elapsed += time_elapsed
+
+        if subscriptions is None:
+            stats.by_subscription += 1
+        elif is_state_change or stats.refreshed == 0:
+            stats.by_state_change += 1
+            self.fields = subscriptions.get(type(state), ())
+            self.values = [getattr(state, field) for field in self.fields]
+        elif self._update_values(state):
+            stats.by_subscription += 1
+        elif self.wake_up is not None and self.time_elapsed >= self.wake_up:
+            stats.by_timer += 1
+        else:
+            stats.skipped += 1
+            return
+
+        self.handler.refresh(state, is_state_change, self.time_elapsed)
+        stats.refreshed += 1
+        self.time_elapsed = ZERO_TIME_DELTA
+        self.wake_up = self.handler.wake_up_after()
+
+    def _update_values(self, state):
+        is_changed = False
+        values = self.values
+        for i, field in enumerate(self.fields):
+            value = getattr(state, field)
+            if value is not values[i] and value != values[i]:
+                values[i] = value
+                is_changed = True
+        return is_changed
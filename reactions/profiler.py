@@ -0,0 +1,123 @@
+import collections
+import datetime
+import functools
+import logging
+import logging.handlers
+import pathlib
+import sys
+import threading
+import time
+
+from reactions import handler, states
+
+_SAMPLE_PERIOD_SECONDS = 0.005  # 5 ms
+_MAX_STACK_DEPTH = 64
+
+logger = logging.getLogger(__name__)
+
+
+# A sampling profiler which snapshots the stacks of every thread from a background thread.  Each
+# sample is tagged with the state of the game at the time, and the results are written out in the
+# collapsed stack format ("frame;frame;frame count" per line), which flamegraph.pl and speedscope
+# can both read.
+#
+# This is registered as a handler so it can follow the state, and stops itself after the requested
+# number of games have finished or the requested number of minutes have passed.
+class Profiler(handler.Handler):
+    subscriptions = {}
+
+    def __init__(self, output_path, games, duration):
+        self.output_path = output_path
+        self.games_remaining = games
+        self.duration = duration
+        self.state_name = "Startup"
+        self.samples = collections.Counter()
+        self.thread = None
+        self.exit = threading.Event()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self.thread.start()
+        logger.info(
+            "Profiling for %s games or %s, writing to %s",
+            self.games_remaining,
+            self.duration,
+            self.output_path,
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def refresh(self, state, is_state_change, time_elapsed):
+        # Only ever assigned, never mutated, so the sampling thread can read it without a lock.
+        self.state_name = type(state).__name__
+
+        if is_state_change and isinstance(state, states.GameFinished):
+            self.games_remaining -= 1
+            if self.games_remaining <= 0:
+                self.stop()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.exit.set()
+        self.thread.join()
+        self.thread = None
+
+    def _sample_loop(self):
+        this_thread = threading.get_ident()
+        deadline = time.monotonic() + self.duration.total_seconds()
+        while not self.exit.wait(_SAMPLE_PERIOD_SECONDS):
+            if time.monotonic() >= deadline:
+                logger.info("Profiling duration finished")
+                break
+
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            state_name = self.state_name
+            # pylint: disable=protected-access
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == this_thread:
+                    continue
+                self.samples[
+                    _collapse(thread_names.get(thread_id, str(thread_id)), state_name, frame)
+                ] += 1
+
+        self._write()
+
+    def _write(self):
+        with self.output_path.open("w", encoding="utf-8") as output:
+            for stack, count in self.samples.most_common():
+                output.write(f"{stack} {count}\n")
+        logger.info("Wrote %s stack samples to %s", sum(self.samples.values()), self.output_path)
+
+
+def _collapse(thread_name, state_name, frame):
+    frames = []
+    while frame is not None and len(frames) < _MAX_STACK_DEPTH:
+        frames.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    frames.append(state_name)
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+
+@functools.lru_cache(maxsize=None)
+def _frame_name(code):
+    return f"{code.co_name} ({pathlib.Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def _output_directory():
+    # Next to reactions.log when logging to a file.  With --no-screen the logs go to stdout, and
+    # the service has no working directory of its own, so use the home directory like the high
+    # score does.
+    for log_handler in logging.getLogger().handlers:
+        if isinstance(log_handler, logging.handlers.RotatingFileHandler):
+            return pathlib.Path(log_handler.baseFilename).parent
+    return pathlib.Path.home()
+
+
+def profiler(games, minutes):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    output_path = _output_directory() / f"reactions-profile-{timestamp}.folded"
+    return Profiler(output_path, games, datetime.timedelta(minutes=minutes))
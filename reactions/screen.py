@@ -7,6 +7,8 @@ from reactions import handler, states
 
 WIN_COLS = 80
 WIN_LINES = 20
+MAIN_Y_POSITION = math.ceil((WIN_LINES - 2) / 2)
+ZERO_TIME_DELTA = datetime.timedelta()
 
 
 def new_screen(stdscr, enable_screen):
@@ -16,11 +18,18 @@ def new_screen(stdscr, enable_screen):
 
 
 class Screen(handler.Handler):
+    subscriptions = handler.SCORE_SUBSCRIPTIONS
+
     def __init__(self, stdscr):
         self.stdscr = stdscr
         self.win_scores = None
         self.win_footer = None
         self.win_main = None
+        # What's currently drawn in win_scores, as centiseconds, so that the window is only redrawn
+        # when the text would change.
+        self.drawn_current_score = None
+        self.drawn_high_score = None
+        self.is_main_drawn = False
 
     def __enter__(self):
         self.stdscr.clear()
@@ -47,7 +56,10 @@ class Screen(handler.Handler):
 
     def refresh(self, state, is_state_change, time_elapsed):
         self._refresh_win_scores(state)
-        self._refresh_win_main(state)
+        # The main window only depends on fields which are fixed for the lifetime of each state.
+        if is_state_change or not self.is_main_drawn:
+            self._refresh_win_main(state)
+            self.is_main_drawn = True
         self._refresh_win_footer()
 
     def _refresh_win_footer(self):
@@ -57,16 +69,13 @@ class Screen(handler.Handler):
         self.win_footer.refresh()
 
     def _refresh_win_scores(self, state):
-        self.win_scores.move(0, 0)
-        self.win_scores.clrtoeol()
-
         match state:
             case states.WaitingOnButton(high_score=high_score, current_score=current_score):
                 self._add_win_scores(current_score, high_score)
             case states.GameAboutToStart(high_score=high_score):
-                self._add_win_scores(datetime.timedelta(), high_score)
+                self._add_win_scores(ZERO_TIME_DELTA, high_score)
             case states.NotStarted(high_score=high_score):
-                self._add_win_scores(datetime.timedelta(), high_score)
+                self._add_win_scores(ZERO_TIME_DELTA, high_score)
             case states.CoolDown(high_score=high_score, current_score=current_score):
                 self._add_win_scores(current_score, high_score)
             case states.GameFinishedCoolDown(high_score=high_score, current_score=current_score):
@@ -76,37 +85,43 @@ class Screen(handler.Handler):
             case _:
                 raise NotImplementedError()
 
-        self.win_scores.refresh()
-
     def _add_win_scores(self, current_score, high_score):
+        current_centi_secs = score_as_centi_secs(current_score)
+        high_centi_secs = score_as_centi_secs(high_score)
+        if (
+            current_centi_secs == self.drawn_current_score
+            and high_centi_secs == self.drawn_high_score
+        ):
+            return
+        self.drawn_current_score = current_centi_secs
+        self.drawn_high_score = high_centi_secs
+
+        self.win_scores.move(0, 0)
+        self.win_scores.clrtoeol()
         self.win_scores.addstr(0, 0, f"{format_score(current_score)} <- Current score")
         high_score_msg = f"High Score -> {format_score(high_score)}"
         self.win_scores.addstr(0, WIN_COLS - len(high_score_msg) - 1, high_score_msg)
+        self.win_scores.refresh()
 
     def _refresh_win_main(self, state):
-        y_position = math.ceil((WIN_LINES - 2) / 2)
-
-        def centre_message(message):
-            self.win_main.addstr(y_position, math.ceil((WIN_COLS - len(message)) / 2), message)
-
-        self.win_main.move(y_position, 0)
+        self.win_main.move(MAIN_Y_POSITION, 0)
         self.win_main.clrtoeol()
 
         match state:
             case states.NotStarted():
-                centre_message("Press N to start")
+                self._centre_message("Press N to start")
             case states.GameAboutToStart():
-                centre_message("Get Ready...")
+                self._centre_message("Get Ready...")
             case states.CoolDown():
-                centre_message("Get Ready..")
+                self._centre_message("Get Ready..")
             case states.WaitingOnButton(button=button):
-                centre_message(f"Press button: {button.key}")
+                self._centre_message(f"Press button: {button.key}")
             case states.GameFinished(current_score=current_score):
-                centre_message(
+                self._centre_message(
                     f"Your score: {format_score(current_score)}.  Press N to play again."
                 )
             case states.GameFinishedCoolDown(current_score=current_score):
-                centre_message(
+                self._centre_message(
                     f"Your score: {format_score(current_score)}.  Press N to play again."
                 )
             case _:
@@ -114,6 +129,9 @@ class Screen(handler.Handler):
 
         self.win_main.refresh()
 
+    def _centre_message(self, message):
+        self.win_main.addstr(MAIN_Y_POSITION, math.ceil((WIN_COLS - len(message)) / 2), message)
+
 
 def read_keys(stdscr, keys):
     is_exit = False
@@ -140,6 +158,10 @@ def read_keys(stdscr, keys):
 wrapper = curses.wrapper
 
 
+def score_as_centi_secs(score):
+    return score.seconds * 100 + score.microseconds // 10_000
+
+
 def format_score(score):
     return f"{score.seconds:02d}:{math.floor(score.microseconds / 10_000):02}"
 
@@ -1,11 +1,18 @@
-import math
-
 import tm1637
 
 from reactions import handler, states
 
 
 class Displays(handler.Handler):
+    subscriptions = {
+        states.NotStarted: ("high_score",),
+        states.GameAboutToStart: (),
+        states.CoolDown: ("high_score", "current_score"),
+        states.WaitingOnButton: ("high_score", "current_score"),
+        states.GameFinishedCoolDown: ("high_score", "current_score"),
+        states.GameFinished: ("high_score", "current_score"),
+    }
+
     def __init__(self, current, high_score):
         self.current = current
         self.high_score = high_score
@@ -43,34 +50,57 @@ class Displays(handler.Handler):
         self.high_score.clear()
 
 
+_CLEAR = "clear"
+_NUMBERS = "numbers"
+_TEXT = "text"
+_BLANK_SEGMENTS = [0, 0, 0, 0]
+
+
 class Display:
+    # What the device is currently showing is kept in separate slots, rather than as a tuple, so
+    # that checking whether a write is needed doesn't allocate on every tick.
+    __slots__ = ("device", "mode", "secs", "centi_secs", "message")
+
     def __init__(self, device):
         self.device = device
-        self.state = None
+        self.mode = _CLEAR
+        self.secs = None
+        self.centi_secs = None
+        self.message = None
 
     def clear(self):
-        if self.state is not None:
-            self.device.write([0, 0, 0, 0])
-            self.state = None
+        if self.mode is not _CLEAR:
+            self.device.write(_BLANK_SEGMENTS)
+            self.mode = _CLEAR
 
     def write_score(self, score):
         secs = min(score.seconds, 99)
-        centi_secs = math.floor(score.microseconds / 10_000)
+        centi_secs = score.microseconds // 10_000
         self.write_numbers(secs, centi_secs)
 
     def write_numbers(self, secs, centi_secs):
-        if self.state != ("numbers", secs, centi_secs):
+        if self.mode is not _NUMBERS or self.secs != secs or self.centi_secs != centi_secs:
             self.device.numbers(secs, centi_secs)
-            self.state = ("numbers", secs, centi_secs)
+            self.mode = _NUMBERS
+            self.secs = secs
+            self.centi_secs = centi_secs
 
     def text(self, message):
-        if self.state != ("text", message):
+        if self.mode is not _TEXT or self.message != message:
             self.device.write(self.device.encode_string(message))
-            self.state = ("text", message)
+            self.mode = _TEXT
+            self.message = message
+
+
+def new_devices(new_device=None):
+    # Returns the current score and high score devices.
+    new_device = new_device or tm1637.TM1637
+    return new_device(18, 15), new_device(24, 23)
 
 
-def displays(is_rpi):
+def displays(is_rpi, new_device=None):
     if is_rpi:
-        return Displays(Display(tm1637.TM1637(18, 15)), Display(tm1637.TM1637(24, 23)))
+        current, high_score = new_devices(new_device)
+        return Displays(Display(current), Display(high_score))
 
     return handler.StubHandler()
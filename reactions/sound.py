@@ -19,7 +19,17 @@ class WaveObjects:
         self.game_over = load_audio_segment("success-chord.wav")
 
 
+class SilentWaveObjects:
+    # For running the game somewhere without speakers, e.g. a tournament host.
+    def __init__(self):
+        self.incorrect_button_press = None
+        self.game_over = None
+
+
 def try_play_audio(audio_segment):
+    if audio_segment is None:
+        return None
+
     try:
         # Not sure why this isn't public API.
         # pylint: disable=protected-access
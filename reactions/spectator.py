@@ -0,0 +1,230 @@
+import datetime
+import http.server
+import json
+import logging
+import queue
+import threading
+
+from reactions import handler, states
+
+_CLIENT_QUEUE_SIZE = 32
+_KEEPALIVE_SECONDS = 15
+# A client which can't take a write for this long is dropped.
+_CLIENT_TIMEOUT_SECONDS = 5
+_ZERO_TIME_DELTA = datetime.timedelta()
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+
+logger = logging.getLogger(__name__)
+
+_PAGE = b"""<!DOCTYPE html>
+<html>
+<head><meta name="viewport" content="width=device-width"><title>Reactions</title></head>
+<body style="font-family: monospace; font-size: 8vw; text-align: center">
+<div id="state"></div>
+<div>Score <span id="score"></span></div>
+<div>Press <span id="target"></span></div>
+<div>High score <span id="high_score"></span></div>
+<script>
+let game = {};
+function format(ms) {
+  return ms === undefined ? "" : (ms / 1000).toFixed(2);
+}
+function render() {
+  document.getElementById("state").textContent = game.state || "";
+  document.getElementById("score").textContent = format(game.score_ms);
+  document.getElementById("target").textContent = game.target || "-";
+  document.getElementById("high_score").textContent = format(game.high_score_ms);
+}
+const events = new EventSource("/events");
+events.addEventListener("snapshot", (event) => { game = JSON.parse(event.data); render(); });
+events.onmessage = (event) => { Object.assign(game, JSON.parse(event.data)); render(); };
+</script>
+</body>
+</html>
+"""
+
+
+# Publishes the game to spectators over server-sent events.  On connecting, each client gets a
+# snapshot of the whole game, and after that only the fields which changed.  Score updates are
+# throttled to a fixed rate, while everything else is sent straight away.
+#
+# The main loop never waits on a client: each client has a bounded queue, and if it fills up the
+# client is sent a fresh snapshot once it catches up instead.  Writes happen on the server's own
+# per-client threads.
+class Spectator(handler.Handler):
+    subscriptions = handler.SCORE_SUBSCRIPTIONS
+
+    def __init__(self, address, score_period):
+        self.address = address
+        self.score_period = score_period
+        self.published = _Published()
+        # Replaced, never mutated, so client threads can read it without a lock.
+        self.snapshot = {}
+        self.clients = _Clients()
+        self.exit = threading.Event()
+        self.server = None
+
+    def __enter__(self):
+        self.server = http.server.ThreadingHTTPServer(self.address, _RequestHandler)
+        self.server.daemon_threads = True
+        self.server.spectator = self
+        threading.Thread(target=self.server.serve_forever, name="spectator", daemon=True).start()
+        logger.info("Spectator feed on http://%s:%s/", *self.address)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.exit.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def refresh(self, state, is_state_change, time_elapsed):
+        published = self.published
+        published.since_score += time_elapsed
+
+        # Only subscribed to the scores, so if it's not a state change and the high score hasn't
+        # changed then it must be the current score.  Check this before building anything, as it's
+        # on every tick of a round.
+        if (
+            not is_state_change
+            and state.high_score == published.high_score
+            and published.since_score < self.score_period
+        ):
+            published.is_score_pending = True
+            return
+
+        snapshot = _snapshot(state)
+
+        delta = {
+            field: value
+            for field, value in snapshot.items()
+            if self.snapshot.get(field, None) != value
+        }
+        published.since_score = _ZERO_TIME_DELTA
+        published.is_score_pending = False
+        if not delta:
+            return
+
+        published.high_score = state.high_score
+        self.snapshot = snapshot
+        self.clients.publish(delta)
+
+    def wake_up_after(self):
+        if self.published.is_score_pending:
+            return self.score_period - self.published.since_score
+        return None
+
+
+# What was last sent to the clients, for throttling the score updates.
+class _Published:
+    __slots__ = ("since_score", "is_score_pending", "high_score")
+
+    def __init__(self):
+        self.since_score = _ZERO_TIME_DELTA
+        self.is_score_pending = False
+        self.high_score = None
+
+
+class _Clients:
+    # Added and removed by the server's threads, published to by the main loop.
+    def __init__(self):
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def publish(self, delta):
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(delta)
+            except queue.Full:
+                client.is_overflowed = True
+
+    def add(self):
+        client = _Client()
+        with self.lock:
+            self.clients.add(client)
+        logger.info("Spectator connected, %s watching", len(self.clients))
+        return client
+
+    def remove(self, client):
+        with self.lock:
+            self.clients.discard(client)
+        logger.info("Spectator disconnected, %s watching", len(self.clients))
+
+
+class _Client(queue.Queue):
+    def __init__(self):
+        super().__init__(maxsize=_CLIENT_QUEUE_SIZE)
+        self.is_overflowed = False
+
+
+def _snapshot(state):
+    match state:
+        case states.WaitingOnButton(round_=round_, button=button):
+            target = button.key
+        case states.CoolDown(round_=round_):
+            target = None
+        case _:
+            round_, target = None, None
+
+    return {
+        "state": type(state).__name__,
+        "round": round_,
+        "target": target,
+        "score_ms": getattr(state, "current_score", _ZERO_TIME_DELTA) // _MILLISECOND,
+        "high_score_ms": state.high_score // _MILLISECOND,
+    }
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    timeout = _CLIENT_TIMEOUT_SECONDS
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == "/":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(_PAGE)))
+            self.end_headers()
+            self.wfile.write(_PAGE)
+        elif self.path == "/events":
+            self._stream_events()
+        else:
+            self.send_error(404)
+
+    def _stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        feed = self.server.spectator
+        client = feed.clients.add()
+        try:
+            self._send("snapshot", feed.snapshot)
+            while not feed.exit.is_set():
+                if client.is_overflowed:
+                    # Too far behind to catch up with deltas, so start again from a snapshot.
+                    while not client.empty():
+                        client.get_nowait()
+                    client.is_overflowed = False
+                    self._send("snapshot", feed.snapshot)
+                try:
+                    self._send("message", client.get(timeout=_KEEPALIVE_SECONDS))
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+        finally:
+            feed.clients.remove(client)
+
+    def _send(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+def spectator(host, port, score_rate_hz):
+    return Spectator((host, port), datetime.timedelta(seconds=1 / score_rate_hz))
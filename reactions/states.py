@@ -1,23 +1,26 @@
 import dataclasses
 import datetime
 
+# States are mutated in place on every tick of the main loop, so they're slotted to keep attribute
+# access cheap and avoid a per-instance __dict__.
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True)
 class Base:
     high_score: datetime.timedelta
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class NotStarted(Base):
     pass
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class GameAboutToStart(Base):
     elapsed: datetime.timedelta
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CoolDown(Base):
     round_: int
     delay: datetime.timedelta
@@ -25,19 +28,20 @@ class CoolDown(Base):
     current_score: datetime.timedelta
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class WaitingOnButton(Base):
     round_: int
     button: str
     current_score: datetime.timedelta
+    round_start_score: datetime.timedelta
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class GameFinishedCoolDown(Base):
     current_score: datetime.timedelta
     elapsed: datetime.timedelta
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class GameFinished(Base):
     current_score: datetime.timedelta
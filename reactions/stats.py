@@ -0,0 +1,13 @@
+import statistics
+
+
+def summarise(samples):
+    # Summarises a list of durations in seconds, as whole microseconds.
+    samples = sorted(samples)
+    return {
+        "samples": len(samples),
+        "min_us": round(samples[0] * 1e6),
+        "median_us": round(statistics.median(samples) * 1e6),
+        "p90_us": round(statistics.quantiles(samples, n=10)[-1] * 1e6),
+        "max_us": round(samples[-1] * 1e6),
+    }
@@ -0,0 +1,474 @@
+import collections
+import datetime
+import logging
+import os
+import selectors
+import socket
+import struct
+import time
+
+from reactions import sound, states
+
+# A small binary protocol for running the state machines of several cabinets (or several game
+# instances on one Pi) from a single host process.  Cabinets send their key presses to the host, and
+# the host sends back the state of that cabinet's game whenever it changes.  All messages are single
+# datagrams, over UDP or a Unix socket, starting with a header of protocol version, message type
+# and game id.
+_VERSION = 2
+_HEADER = struct.Struct("!BBH")
+# HELLO: cabinet -> host.  Registers (or re-registers) the cabinet's address for a game id, along
+# with its calibrated latency correction in microseconds.  Also sent periodically as a keepalive.
+_HELLO = 1
+_HELLO_BODY = struct.Struct("!I")
+# KEYS: cabinet -> host.  The round the cabinet was showing and the time in microseconds since its
+# lamp lit, then the keys pressed since the last KEYS message as ASCII.  Rounds are scored with the
+# cabinet's own time, so that the network delay both ways isn't added to the player's score.
+_KEYS = 2
+_KEYS_BODY = struct.Struct("!BI")
+# The round in KEYS when the cabinet isn't waiting on a button.
+_NO_ROUND = 0xFF
+# STATE: host -> cabinet.  State type, round, target key, then high score, current score, elapsed,
+# delay and round start score in microseconds.  Fields which don't apply to the state type are 0.
+_STATE = 3
+_STATE_BODY = struct.Struct("!BBcIIIII")
+
+_STATE_TYPES = [
+    states.NotStarted,
+    states.GameAboutToStart,
+    states.CoolDown,
+    states.WaitingOnButton,
+    states.GameFinishedCoolDown,
+    states.GameFinished,
+]
+_STATE_CODES = {state_type: code for code, state_type in enumerate(_STATE_TYPES)}
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_ZERO_TIME_DELTA = datetime.timedelta()
+
+_MAX_DATAGRAM = 512
+# The host resends every game's state, and cabinets resend HELLO, this often so that lost datagrams
+# or restarts on either side are recovered from.
+_RESEND_PERIOD = datetime.timedelta(seconds=1)
+_STATS_PERIOD = datetime.timedelta(minutes=1)
+
+logger = logging.getLogger(__name__)
+
+
+def _micros(value):
+    return value // _MICROSECOND
+
+
+def encode_state(game_id, state):
+    key = state.button.key.encode("ascii") if isinstance(state, states.WaitingOnButton) else b" "
+    return _HEADER.pack(_VERSION, _STATE, game_id) + _STATE_BODY.pack(
+        _STATE_CODES[type(state)],
+        getattr(state, "round_", 0),
+        key,
+        _micros(state.high_score),
+        _micros(getattr(state, "current_score", _ZERO_TIME_DELTA)),
+        _micros(getattr(state, "elapsed", _ZERO_TIME_DELTA)),
+        _micros(getattr(state, "delay", _ZERO_TIME_DELTA)),
+        _micros(getattr(state, "round_start_score", _ZERO_TIME_DELTA)),
+    )
+
+
+def decode_state(body, buttons_by_key):
+    code, round_, key, high, current, elapsed, delay, round_start = _STATE_BODY.unpack(body)
+    high_score_ = datetime.timedelta(microseconds=high)
+    current_score = datetime.timedelta(microseconds=current)
+    elapsed = datetime.timedelta(microseconds=elapsed)
+
+    match _STATE_TYPES[code]:
+        case states.NotStarted:
+            return states.NotStarted(high_score=high_score_)
+        case states.GameAboutToStart:
+            return states.GameAboutToStart(high_score=high_score_, elapsed=elapsed)
+        case states.CoolDown:
+            return states.CoolDown(
+                high_score=high_score_,
+                round_=round_,
+                delay=datetime.timedelta(microseconds=delay),
+                elapsed=elapsed,
+                current_score=current_score,
+            )
+        case states.WaitingOnButton:
+            return states.WaitingOnButton(
+                high_score=high_score_,
+                round_=round_,
+                button=buttons_by_key[key.decode("ascii")],
+                current_score=current_score,
+                round_start_score=datetime.timedelta(microseconds=round_start),
+            )
+        case states.GameFinishedCoolDown:
+            return states.GameFinishedCoolDown(
+                high_score=high_score_, current_score=current_score, elapsed=elapsed
+            )
+        case states.GameFinished:
+            return states.GameFinished(high_score=high_score_, current_score=current_score)
+    raise NotImplementedError(code)
+
+
+def decode_header(data):
+    version, message_type, game_id = _HEADER.unpack_from(data)
+    if version != _VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    return message_type, game_id, data[_HEADER.size :]
+
+
+class SocketTransport:
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+    def send(self, data, address):
+        try:
+            self.sock.sendto(data, address)
+        except (BlockingIOError, ConnectionRefusedError, FileNotFoundError):
+            # A datagram protocol, so just drop it.  The next resend will catch up.
+            logger.debug("Dropped datagram to %s", address, exc_info=True)
+
+    def receive(self):
+        datagrams = []
+        while True:
+            try:
+                datagrams.append(self.sock.recvfrom(_MAX_DATAGRAM))
+            except (BlockingIOError, ConnectionRefusedError):
+                return datagrams
+
+    def wait(self, timeout_seconds):
+        self.selector.select(timeout_seconds)
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
+
+
+class LoopbackNetwork:
+    # An in-process stand in for the network, so a host and several cabinets can be run together
+    # from one thread (e.g. in a test) without any sockets.
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+
+    def transport(self, address):
+        return _LoopbackTransport(self, address)
+
+
+class _LoopbackTransport:
+    def __init__(self, network, address):
+        self.network = network
+        self.address = address
+
+    def send(self, data, address):
+        self.network.queues[address].append((data, self.address))
+
+    def receive(self):
+        queue = self.network.queues[self.address]
+        datagrams = list(queue)
+        queue.clear()
+        return datagrams
+
+    def wait(self, timeout_seconds):
+        time.sleep(timeout_seconds)
+
+    def close(self):
+        pass
+
+
+def parse_address(spec):
+    # "udp:HOST:PORT" or "unix:PATH".  Returns the socket family and address.
+    kind, _, rest = spec.partition(":")
+    if kind == "udp":
+        host, _, port = rest.rpartition(":")
+        return socket.AF_INET, (host, int(port))
+    if kind == "unix":
+        return socket.AF_UNIX, rest
+    raise ValueError(f"Expected udp:HOST:PORT or unix:PATH, not {spec}")
+
+
+def host_transport(spec):
+    family, address = parse_address(spec)
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if family == socket.AF_UNIX and os.path.exists(address):
+        os.unlink(address)
+    sock.bind(address)
+    logger.info("Tournament host listening on %s", spec)
+    return SocketTransport(sock)
+
+
+def client_transport(spec):
+    # Returns the transport, and the address of the host.
+    family, address = parse_address(spec)
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if family == socket.AF_UNIX:
+        # Unix datagram sockets need binding to an address of their own to receive replies.  The
+        # abstract namespace means there's no file to clean up afterwards.
+        sock.bind(f"\0reactions-{os.getpid()}")
+    return SocketTransport(sock), address
+
+
+class _Sender:
+    # Keeps the other end up to date with a message, sending it whenever it changes and resending
+    # it every _RESEND_PERIOD, so that lost datagrams or restarts on either side are recovered from.
+    __slots__ = ("address", "message", "since_sent")
+
+    def __init__(self, address, message=None):
+        self.address = address
+        self.message = message
+        self.since_sent = _RESEND_PERIOD
+
+    def update(self, transport, message, time_elapsed):
+        self.since_sent += time_elapsed
+        if message != self.message or self.since_sent >= _RESEND_PERIOD:
+            transport.send(message, self.address)
+            self.message = message
+            self.since_sent = _ZERO_TIME_DELTA
+
+
+class _Game:
+    __slots__ = (
+        "game_id",
+        "cabinet",
+        "state",
+        "keys",
+        "round_elapsed",
+        "shuffled_buttons_iter",
+        "latency_correction",
+    )
+
+    def __init__(self, game_id, address, high_score_, shuffled_buttons_iter):
+        self.game_id = game_id
+        # Sends the STATE messages.
+        self.cabinet = _Sender(address)
+        self.state = states.NotStarted(high_score=high_score_)
+        self.keys = []
+        # The cabinet's time from its lamp lighting to the first key pressed in this round, or None.
+        self.round_elapsed = None
+        self.shuffled_buttons_iter = shuffled_buttons_iter
+        self.latency_correction = _ZERO_TIME_DELTA
+
+
+class _HandleStats:
+    __slots__ = ("handled", "handle_ns", "max_handle_ns")
+
+    def __init__(self):
+        self.handled = 0
+        self.handle_ns = 0
+        self.max_handle_ns = 0
+
+    def record(self, elapsed_ns):
+        self.handled += 1
+        self.handle_ns += elapsed_ns
+        self.max_handle_ns = max(self.max_handle_ns, elapsed_ns)
+
+
+class Host:
+    # Runs one state machine per game id, all from a single thread.  The state machine itself is
+    # game.advance_state, with the sounds bound to something silent as the cabinets play their own.
+    def __init__(self, transport, advance_state, new_shuffled_buttons_iter, high_score_):
+        self.transport = transport
+        self.advance_state = advance_state
+        self.new_shuffled_buttons_iter = new_shuffled_buttons_iter
+        self.high_score = high_score_
+        self.games = {}
+        self.stats = _HandleStats()
+        self.since_stats = _ZERO_TIME_DELTA
+
+    def run(self, tick_period_seconds):
+        last_tick = time.monotonic_ns()
+        while True:
+            self.transport.wait(tick_period_seconds)
+            this_tick = time.monotonic_ns()
+            self.step(datetime.timedelta(microseconds=(this_tick - last_tick) // 1000))
+            last_tick = this_tick
+
+    def step(self, time_elapsed):
+        for data, address in self.transport.receive():
+            start = time.perf_counter_ns()
+            try:
+                self.handle(data, address)
+            except (ValueError, struct.error):
+                logger.warning("Bad datagram from %s", address, exc_info=True)
+            self.stats.record(time.perf_counter_ns() - start)
+
+        start = time.perf_counter_ns()
+        self.tick(time_elapsed)
+        self.stats.record(time.perf_counter_ns() - start)
+
+        self.since_stats += time_elapsed
+        if self.since_stats >= _STATS_PERIOD:
+            self.log_stats()
+            self.since_stats = _ZERO_TIME_DELTA
+
+    def handle(self, data, address):
+        message_type, game_id, body = decode_header(data)
+        game = self.games.get(game_id)
+
+        if message_type == _HELLO:
+            if game is None:
+                logger.info("New game %s from %s", game_id, address)
+                game = self.games[game_id] = _Game(
+                    game_id, address, self.high_score, self.new_shuffled_buttons_iter()
+                )
+            (correction,) = _HELLO_BODY.unpack(body)
+            game.latency_correction = datetime.timedelta(microseconds=correction)
+            game.cabinet.address = address
+            # Make sure the cabinet has the current state straight away.
+            game.cabinet.message = None
+        elif message_type == _KEYS:
+            if game is None:
+                raise ValueError(f"Keys for unknown game {game_id}")
+            self._handle_keys(game, body)
+        else:
+            raise ValueError(f"Unexpected message type {message_type}")
+
+    @staticmethod
+    def _handle_keys(game, body):
+        round_, round_elapsed = _KEYS_BODY.unpack_from(body)
+        keys = body[_KEYS_BODY.size :].decode("ascii")
+        state = game.state
+        if isinstance(state, states.WaitingOnButton):
+            if round_ != state.round_:
+                # Pressed before this round's lamp was lit on the cabinet, which the state machine
+                # would have ignored if it were running there.
+                logger.info(
+                    "Dropping keys %s for round %s from game %s", keys, round_, game.game_id
+                )
+                return
+            if game.round_elapsed is None:
+                game.round_elapsed = datetime.timedelta(microseconds=round_elapsed)
+        game.keys.extend(keys)
+
+    def tick(self, time_elapsed):
+        for game in self.games.values():
+            game_time_elapsed = time_elapsed
+            if game.round_elapsed is not None:
+                # Score the round with the cabinet's time, rather than this host's, which also
+                # includes the STATE message getting to the cabinet and the KEYS getting back.
+                game.state.current_score = game.state.round_start_score + game.round_elapsed
+                game.round_elapsed = None
+                game_time_elapsed = _ZERO_TIME_DELTA
+
+            _, game.state = self.advance_state(
+                game.state,
+                game.keys,
+                game_time_elapsed,
+                game.shuffled_buttons_iter,
+                latency_correction=game.latency_correction,
+            )
+            game.keys.clear()
+
+            if game.state.high_score < self.high_score:
+                self._new_high_score(game)
+
+        for game in self.games.values():
+            game.cabinet.update(
+                self.transport, encode_state(game.game_id, game.state), time_elapsed
+            )
+
+    def _new_high_score(self, winner):
+        # advance_state has already saved it.  Share it with every other game so the cabinets all
+        # show the same leaderboard.
+        self.high_score = winner.state.high_score
+        logger.info("New tournament high score %s from game %s", self.high_score, winner.game_id)
+        for game in self.games.values():
+            game.state.high_score = self.high_score
+
+    def log_stats(self):
+        stats = self.stats
+        if stats.handled:
+            logger.info(
+                "Host handled %s events for %s games: mean=%.1fus, max=%.1fus",
+                stats.handled,
+                len(self.games),
+                stats.handle_ns / stats.handled / 1_000,
+                stats.max_handle_ns / 1_000,
+            )
+        self.stats = _HandleStats()
+
+
+class Client:
+    # The cabinet's side: stands in for advance_state in the main loop, forwarding keys to the host
+    # and returning whatever state the host last sent.
+    def __init__(
+        self, transport, host_address, game_id, buttons_by_key, latency_correction, wave_objects
+    ):  # pylint: disable=too-many-arguments
+        self.transport = transport
+        # Sends HELLO, which never changes, so it's only ever resent.
+        self.host = _Sender(
+            host_address,
+            _HEADER.pack(_VERSION, _HELLO, game_id) + _HELLO_BODY.pack(_micros(latency_correction)),
+        )
+        self.game_id = game_id
+        self.buttons_by_key = buttons_by_key
+        self.wave_objects = wave_objects
+        # Time since this cabinet's lamp lit in the current round, counted the same way as the
+        # state machine counts current_score.
+        self.round_elapsed = _ZERO_TIME_DELTA
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.transport.close()
+
+    def advance_state(self, state, keys, time_elapsed, input_delay=_ZERO_TIME_DELTA):
+        # input_delay is how long before this tick the first key was pressed, if the input knows.
+        self.host.update(self.transport, self.host.message, time_elapsed)
+
+        is_waiting = isinstance(state, states.WaitingOnButton)
+        if is_waiting:
+            self.round_elapsed += time_elapsed
+        if keys:
+            self._send_keys(state if is_waiting else None, keys, input_delay)
+            # The host plays no sounds, so play the ones the state machine would have played here.
+            if is_waiting and keys[0] != state.button.key:
+                sound.try_play_audio(self.wave_objects.incorrect_button_press)
+
+        new_state = self._receive_state()
+        if new_state is None:
+            return False, state
+
+        is_state_change = type(new_state) != type(state)  # pylint: disable=unidiomatic-typecheck
+        if isinstance(new_state, states.WaitingOnButton) and (
+            is_state_change or new_state.round_ != state.round_
+        ):
+            self.round_elapsed = _ZERO_TIME_DELTA
+        if is_state_change:
+            logger.info("State Change: %s -> %s", state, new_state)
+            if isinstance(new_state, states.GameFinishedCoolDown):
+                sound.try_play_audio(self.wave_objects.game_over)
+        return is_state_change, new_state
+
+    def _send_keys(self, waiting_state, keys, input_delay):
+        if waiting_state is None:
+            body = _KEYS_BODY.pack(_NO_ROUND, 0)
+        else:
+            round_elapsed = max(self.round_elapsed - input_delay, _ZERO_TIME_DELTA)
+            body = _KEYS_BODY.pack(waiting_state.round_, _micros(round_elapsed))
+        self.transport.send(
+            _HEADER.pack(_VERSION, _KEYS, self.game_id) + body + "".join(keys).encode("ascii"),
+            self.host.address,
+        )
+
+    def _receive_state(self):
+        # The latest state from the host, or None if there wasn't one.  Anything which can't be
+        # decoded, e.g. from a host running a different version, is dropped rather than allowed to
+        # take the game down.
+        new_state = None
+        for data, address in self.transport.receive():
+            try:
+                message_type, game_id, body = decode_header(data)
+                if message_type == _STATE and game_id == self.game_id:
+                    new_state = decode_state(body, self.buttons_by_key)
+            except (ValueError, IndexError, KeyError, struct.error):
+                logger.warning("Bad datagram from %s", address, exc_info=True)
+        return new_state
+
+
+def client(spec, game_id, buttons_by_key, latency_correction, wave_objects):
+    transport, host_address = client_transport(spec)
+    logger.info("Playing game %s on tournament host %s", game_id, spec)
+    return Client(
+        transport, host_address, game_id, buttons_by_key, latency_correction, wave_objects
+    )